@@ -1,6 +1,20 @@
 import argparse
 
 
+add_parser = argparse.ArgumentParser(description="add")
+add_parser.add_argument("command_name")
+add_parser.add_argument("paths", metavar="path", nargs="*",
+                        help="The file or directory to be added to the index")
+add_parser.add_argument('-j', "--jobs", metavar="N", type=int,
+                        dest="jobs", action="store", default=None,
+                        help="The number of files hashed and stored concurrently, "
+                             "defaults to the CPU count")
+add_parser.add_argument("--chunked", metavar="SIZE", type=int,
+                        dest="chunked_size", action="store", default=None,
+                        help="Stores the files of at least SIZE bytes as content-defined chunks, "
+                             "so that their next versions only take the space of the chunks they change")
+
+
 commit_parser = argparse.ArgumentParser(description="commit")
 commit_parser.add_argument("command_name")
 commit_parser.add_argument('-m', "--message", metavar="message",
@@ -35,4 +49,45 @@ merge_parser.add_argument("branch", metavar="name", action="store",
                           help="Branch that is going to be merged onto HEAD")
 
 
-log_parser = argparse.ArgumentParser(description="help ")
+log_parser = argparse.ArgumentParser(description="log")
+log_parser.add_argument("command_name")
+log_parser.add_argument("target", metavar="name/hash", action="store", nargs="?", default=None,
+                        help="Branch, tag or commit hash to start from, HEAD by default")
+log_parser.add_argument('-n', "--limit", metavar="N", type=int, dest="limit", default=None,
+                        help="Show at most N commits")
+log_parser.add_argument("--skip", metavar="N", type=int, dest="skip", default=0,
+                        help="Skip the first N commits")
+log_parser.add_argument("--since", metavar="date", dest="since", default=None,
+                        help="Show only commits made at or after the date (YYYY-MM-DD[ HH:MM:SS])")
+log_parser.add_argument("--until", metavar="date", dest="until", default=None,
+                        help="Show only commits made at or before the date (YYYY-MM-DD[ HH:MM:SS])")
+
+
+log_errors_parser = argparse.ArgumentParser(description="log-errors")
+log_errors_parser.add_argument("command_name")
+log_errors_parser.add_argument('-n', "--limit", metavar="N", type=int, dest="limit", default=10,
+                               help="Show at most N errors, 10 by default")
+log_errors_parser.add_argument('-v', "--verbose", action="store_true", dest="verbose",
+                               help="Show the tracebacks of the errors as well")
+
+
+server_parser = argparse.ArgumentParser(description="server")
+server_parser.add_argument("command_name")
+server_parser.add_argument("--detach", action="store_true", dest="detach",
+                           help="Run the server in the background")
+server_parser.add_argument("--stop", action="store_true", dest="stop",
+                           help="Stop the server of the repository")
+
+
+diff_parser = argparse.ArgumentParser(description="diff")
+diff_parser.add_argument("command_name")
+diff_parser.add_argument("targets", metavar="name/hash", nargs="*",
+                         help="No commits to compare the working directory with the index, one to compare it "
+                              "with the commit, two to compare the commits")
+diff_parser.add_argument("--stat", action="store_true", dest="stat",
+                         help="Only name the changed files along with their sizes")
+diff_parser.add_argument("--size-limit", metavar="bytes", type=int, dest="size_limit", default=None,
+                         help="Files larger than this are not compared line by line, 1 MiB by default")
+diff_parser.add_argument("--rename-threshold", metavar="percent", type=int, dest="rename_threshold", default=None,
+                         help="How much of a deleted file an added one must share to be taken for it renamed, "
+                              "50 by default")
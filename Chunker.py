@@ -0,0 +1,65 @@
+from hashlib import sha1
+
+# Large files are cut into chunks where a "gear" hash of the bytes read since
+# the start of the chunk has the bits of a mask unset (FastCDC). The cut points
+# depend on the contents alone, so bytes inserted or appended to a file change
+# the chunks around them and leave the others as they were.
+# Chunks are never shorter than the minimum, unless the file ends, nor longer
+# than the maximum; a harder mask before the average size and an easier one
+# after it keep most of them close to the average
+min_chunk_size = 64 << 10
+average_chunk_size = 256 << 10
+max_chunk_size = 1 << 20
+
+_hash_bits = 64
+_hash_mask = (1 << _hash_bits) - 1
+_gear = [int.from_bytes(sha1(bytes([byte])).digest()[:8], 'big') for byte in range(256)]
+
+
+def _spread_mask(bits: int) -> int:
+    """A mask of the given number of bits, spread over the highest 48 bits of the
+    hash, which depend on the last 48 bytes or more rather than on the last few"""
+    return sum(1 << (_hash_bits - 1 - (i * 48) // bits) for i in range(bits))
+
+
+def cut_point(data, start=0) -> int:
+    """Returns where the chunk beginning at start ends: at the first cut point,
+    at max_chunk_size or at the end of data, which is taken for the end of the file"""
+    end = min(len(data), start + max_chunk_size)
+    if end - start <= min_chunk_size:
+        return end
+
+    average_bits = average_chunk_size.bit_length() - 1
+    small_mask = _spread_mask(average_bits + 2)
+    large_mask = _spread_mask(average_bits - 2)
+    normal = min(end, start + average_chunk_size)
+
+    gear = _gear
+    fingerprint = 0
+    position = start + min_chunk_size
+    for byte in data[position:normal]:
+        fingerprint = ((fingerprint << 1) + gear[byte]) & _hash_mask
+        position += 1
+        if not fingerprint & small_mask:
+            return position
+    for byte in data[normal:end]:
+        fingerprint = ((fingerprint << 1) + gear[byte]) & _hash_mask
+        position += 1
+        if not fingerprint & large_mask:
+            return position
+    return end
+
+
+def read_chunks(f):
+    """Yields the chunks of the rest of the file, holding at most
+    a few times max_chunk_size bytes in memory"""
+    buffer = b''
+    while True:
+        # a chunk is only cut short by the end of the buffer at the end of the file
+        if len(buffer) < max_chunk_size:
+            buffer += f.read(2 * max_chunk_size)
+        if not buffer:
+            return
+        end = cut_point(buffer)
+        yield buffer[:end]
+        buffer = buffer[end:]
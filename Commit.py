@@ -1,14 +1,45 @@
-from Files import blobify, unblobify, encoding
-from difflib import unified_diff
+from Files import blobify, unblobify, encoding, object_cache, flatten_tree, diff_trees
+from Diff import detect_renames, unified_hunks, is_binary
+import getpass
+import os
+import re
+from time import time
+
+# parent hashes in the "previous commits: ['...', ...]" line of older commits
+_text_parents = re.compile(r"'([0-9a-f]{40}|none)'")
+
+
+def default_author():
+    """The author of new commits: $GYM_AUTHOR, or the name of the user"""
+    try:
+        return os.environ.get("GYM_AUTHOR") or getpass.getuser()
+    except (KeyError, OSError):
+        return ""
 
 
 class Commit:
+    """A commit object, stored as
+        tree <tree hash>
+        parent <commit hash>        (one line per parent, none for the first commit)
+        author <name>
+        timestamp <seconds since the epoch>
+        message <length of the message in bytes>
+        <message>
+    """
+    __slots__ = ("_message", "_tree_hash", "_previous_commits", "_timestamp", "_author", "_directory")
+
+    # the objects directory of the commits not given one, set by library_init
     _commit_directory: str
 
-    def __init__(self, message: str, tree: str, previous_commits: list):
+    def __init__(self, message: str, tree: str, previous_commits: list, timestamp: int = None, author: str = None,
+                 directory: str = None):
         self._message = message
         self._tree_hash = tree
         self._previous_commits = previous_commits
+        self._timestamp = int(time()) if timestamp is None else timestamp
+        self._author = default_author() if author is None else author
+        # the objects directory the commit and its tree are stored in
+        self._directory = directory
 
     @property
     def message(self):
@@ -20,25 +51,52 @@ class Commit:
 
     @property
     def tree(self):
-        return unblobify(self._tree_hash, Commit._commit_directory).decode(encoding)
+        """The commit tree as "filename filehash" lines"""
+        files = self.files
+        return str.join('\n', [f"{filename} {files[filename]}" for filename in sorted(files)])
+
+    @property
+    def files(self):
+        """The commit tree as a dictionary of form { filename: filehash, ... }"""
+        return flatten_tree(self._tree_hash, Commit._objects(self._directory))
 
     @property
     def pchs(self):
         return self._previous_commits
 
+    @property
+    def timestamp(self):
+        """Seconds since the epoch the commit was created at, 0 for older commits"""
+        return self._timestamp
+
+    @property
+    def author(self):
+        """Who made the commit, empty for older commits"""
+        return self._author
+
     def __str__(self):
         return f"message: {self._message}\n" \
                f"tree: {self._tree_hash}\n" \
-               f"previous commits: {self._previous_commits}"
+               f"previous commits: {self._previous_commits}\n" \
+               f"author: {self._author}\n" \
+               f"timestamp: {self._timestamp}"
 
     def __repr__(self):
         return f"Commit({self._message}, {self._tree_hash}, {self._previous_commits})"
 
     def encode(self):
-        return str(self).encode(encoding)
+        message = self._message.encode(encoding)
+        header = [f"tree {self._tree_hash}"]
+        header += [f"parent {parent}" for parent in self._previous_commits if parent != "none"]
+        header += [f"author {self._author}", f"timestamp {self._timestamp}", f"message {len(message)}"]
+        return '\n'.join(header).encode(encoding) + b'\n' + message
 
     def blobify(self):
-        return blobify(self.encode(), Commit._commit_directory)
+        return blobify(self.encode(), Commit._objects(self._directory))
+
+    @staticmethod
+    def _objects(directory):
+        return directory if directory is not None else Commit._commit_directory
 
     @staticmethod
     def set_commit_directory(directory: str):
@@ -49,76 +107,132 @@ class Commit:
         Commit._commit_directory = directory
 
     @staticmethod
-    def serialize(commit: str):
-        if not isinstance(commit, str):
-            raise TypeError("Expected commit to be a string. "
+    def serialize(commit: bytes):
+        """Parses the commit object into (message, tree hash, parent hashes, timestamp, author),
+        or returns None if it is not a commit. The header is read line by line in a single
+        pass and the message is taken whole by its length, so it may span several lines"""
+        if not isinstance(commit, bytes):
+            raise TypeError("Expected commit to be bytes. "
                             "That's just what happens sometimes :P")
 
+        if commit.startswith(b"message: "):
+            return Commit._serialize_text(commit)
+
+        try:
+            fields = []
+            position = 0
+            while True:
+                end = commit.index(b'\n', position)
+                key, _, value = commit[position:end].decode(encoding).partition(' ')
+                position = end + 1
+                if key == "message":
+                    break
+                fields.append((key, value))
+
+            message = commit[position:]
+            if len(message) != int(value):
+                return None
+
+            keys = [key for key, _ in fields]
+            if len(keys) < 3 or keys != ["tree"] + ["parent"] * (len(keys) - 3) + ["author", "timestamp"]:
+                return None
+            parents = [parent for _, parent in fields[1:-2]] or ["none"]
+            return message.decode(encoding), fields[0][1], parents, int(fields[-1][1]), fields[-2][1]
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _serialize_text(commit: bytes):
+        """Parses the "message: ...", "tree: ...", "previous commits: [...]"
+        and "timestamp: ..." lines of commits older versions wrote"""
         try:
-            message, tree, pch = [e.split(': ')[1] for e in commit.split('\n')]
-            return message, tree, pch
-        except IndexError or ValueError:
+            fields = [line.split(': ', 1)[1] for line in commit.decode(encoding).split('\n')]
+            # the oldest commits were written without a timestamp
+            if len(fields) == 3:
+                fields.append("0")
+            message, tree, previous_commits, timestamp = fields
+            return message, tree, _text_parents.findall(previous_commits), int(timestamp), ""
+        except (IndexError, ValueError):
             return None
 
     @staticmethod
-    def unhash(commit_hash: str):
+    def unhash(commit_hash: str, directory: str = None):
         if not isinstance(commit_hash, str):
             raise TypeError("Expected commit hash to be a string. "
                             "That's just what happens sometimes :P")
 
         if commit_hash == "none":
-            return Commit("", "", ["none"])
-        supposedly_commit = unblobify(commit_hash, Commit._commit_directory).decode(encoding)
+            return Commit("", "", ["none"], 0, "", directory)
+
+        directory = Commit._objects(directory)
+        # parsed commits share the object cache with the raw objects
+        cache_key = (directory, commit_hash, Commit)
+        cached = object_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        supposedly_commit = unblobify(commit_hash, directory)
         serialised = Commit.serialize(supposedly_commit)
-        return Commit(serialised[0], serialised[1], eval(serialised[2])) if serialised \
-            else None
+        if not serialised:
+            return None
+        commit = Commit(*serialised, directory=directory)
+        object_cache.put(cache_key, commit, len(supposedly_commit))
+        return commit
 
     @staticmethod
-    def diff(from_commit_hash: str, to_commit_hash: str):
+    def diff(from_commit_hash: str, to_commit_hash: str, directory: str = None):
         """Computes difference between 'from' commit and 'to' commit,
         with assumption that 'from' is the starting point, and 'to' is the destination"""
         if not from_commit_hash or not to_commit_hash:
             raise Exception
 
-        # commit trees in form of strings
-        from_commit_tree = Commit.unhash(from_commit_hash).tree if from_commit_hash != "none" else ""
-        to_commit_tree = Commit.unhash(to_commit_hash).tree
-
-        # converting to dictionaries of form { filename: filehash, ... }
-        if from_commit_tree:
-            from_commit_tree = {filename: filehash for filename, filehash in map(str.split, from_commit_tree.split('\n'))}
-        else:
-            from_commit_tree = {}
-        to_commit_tree = {filename: filehash for filename, filehash in map(str.split, to_commit_tree.split('\n'))}
+        from_tree_hash = Commit.unhash(from_commit_hash, directory).tree_hash
+        to_tree_hash = Commit.unhash(to_commit_hash, directory).tree_hash
 
         difference = []
-        for filename in from_commit_tree.keys():
-            if filename not in to_commit_tree.keys():
-                difference.append(f"Deleted: {filename} {from_commit_tree[filename]}")
-                continue
-
-            if from_commit_tree[filename] != to_commit_tree[filename]:
-                file_diff = Commit.file_diff_by_hash(from_commit_tree[filename], to_commit_tree[filename])
+        for from_filename, filename, from_version, to_version in \
+                Commit._changes(from_tree_hash, to_tree_hash, directory):
+            from_filehash = from_version[1] if from_version else None
+            to_filehash = to_version[1] if to_version else None
+            if to_filehash is None:
+                difference.append(f"Deleted: {filename} {from_filehash}")
+            elif from_filehash is None:
+                difference.append(f"Added: {filename} {to_filehash}")
+            elif from_filename != filename:
+                file_diff = Commit.file_diff_by_hash(from_filehash, to_filehash, directory) \
+                    if from_filehash != to_filehash else []
                 file_diff = [f"At {pos}: {change}" for pos, change in file_diff]
-                difference.append(f"Changed: {filename} {from_commit_tree[filename][:5]}... "
-                                  f"-> {to_commit_tree[filename][:5]}...\n"
+                difference.append(f"Renamed: {from_filename} -> {filename} {to_filehash[:5]}...\n"
+                                  + '\n'.join(file_diff))
+            else:
+                file_diff = Commit.file_diff_by_hash(from_filehash, to_filehash, directory)
+                file_diff = [f"At {pos}: {change}" for pos, change in file_diff]
+                difference.append(f"Changed: {filename} {from_filehash[:5]}... "
+                                  f"-> {to_filehash[:5]}...\n"
                                   + '\n'.join(file_diff))
-
-        for filename in to_commit_tree.keys():
-            if filename not in from_commit_tree.keys():
-                difference.append(f"Added: {filename} {to_commit_tree[filename]}")
 
         return str.join('\n', sorted(difference))
 
     @staticmethod
-    def file_diff_by_hash(from_file_hash: str, to_file_hash: str):
-        from_file = unblobify(from_file_hash, Commit._commit_directory).decode(encoding)
-        to_file = unblobify(to_file_hash, Commit._commit_directory).decode(encoding)
-
-        diff = unified_diff(from_file.split('\n'), to_file.split('\n'))
-        diff = list(diff)[2:]
-        # Skip the first two lines
-        # since its just file names (empty because none were given to the function)
+    def _changes(from_tree_hash: str, to_tree_hash: str, directory: str = None, max_pairs=None):
+        """Lists the changes between the trees the way detect_renames does,
+        identical subtrees being skipped without reading their files"""
+        directory = Commit._objects(directory)
+        changes = [(filename, ("blob", from_filehash) if from_filehash else None,
+                    ("blob", to_filehash) if to_filehash else None)
+                   for filename, from_filehash, to_filehash in
+                   diff_trees(from_tree_hash, to_tree_hash, directory)]
+        return detect_renames(changes, directory, max_pairs=max_pairs)
+
+    @staticmethod
+    def file_diff_by_hash(from_file_hash: str, to_file_hash: str, directory: str = None):
+        from_file = unblobify(from_file_hash, Commit._objects(directory))
+        to_file = unblobify(to_file_hash, Commit._objects(directory))
+        # binary files have no lines to compare
+        if is_binary(from_file) or is_binary(to_file):
+            return []
+
+        diff = list(unified_hunks(from_file.decode(encoding).split('\n'), to_file.decode(encoding).split('\n')))
 
         enumerated_diff = []
         deletions_counter = 0
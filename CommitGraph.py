@@ -0,0 +1,208 @@
+import heapq
+import os
+import struct
+from contextlib import nullcontext
+
+from Commit import Commit
+
+# The commit-graph file lets the history be walked without reading commit objects:
+#   b"GYMC" | version | record | record | ...
+# Every record is the binary hash of a commit, of its tree and of up to two parents
+# (zeroes where there is none), its timestamp and its generation number, which is
+# one more than the greatest generation of its parents. Records are only ever appended
+graph_magic = b"GYMC"
+graph_version = 1
+max_parents = 2
+
+_header = struct.Struct(">4sI")
+_record = struct.Struct(">20s20s20s20sQI")
+_no_hash = bytes(20)
+
+# how many records are parsed at a time while looking for a commit
+_scan_records = 1024
+
+
+class CommitGraph:
+    """Parents, tree, timestamp and generation number of every commit, read from
+    the commit-graph file and brought up to date with whatever was appended to it"""
+
+    def __init__(self, path: str, objects: str = None):
+        self._path = path
+        # where the commits missing from the graph are read from
+        self._objects = objects
+        self._commits = {}
+        # records between _parsed_from and _end are parsed into _commits
+        self._parsed_from = 0
+        self._end = 0
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self._path)
+        except FileNotFoundError:
+            size = 0
+        # a record still being appended is left for later, as is a header
+        size -= (size - _header.size) % _record.size if size >= _header.size else size
+        if size == self._end:
+            return
+
+        if size < self._end or not self._end:
+            # a new or replaced file is parsed lazily, from its end backwards
+            self._commits = {}
+            if size:
+                with open(self._path, 'rb') as f:
+                    magic, version = _header.unpack(f.read(_header.size))
+                if magic != graph_magic or version != graph_version:
+                    raise ValueError(f'Error: {self._path} is not a commit-graph file')
+            self._parsed_from = self._end = size
+            return
+
+        # records appended since the last read are the newest ones and are parsed right away
+        with open(self._path, 'rb') as f:
+            f.seek(self._end)
+            self._parse(f.read(size - self._end))
+        self._end = size
+
+    def _parse(self, data):
+        for commit, tree, *parents, timestamp, generation in _record.iter_unpack(data):
+            self._commits[commit.hex()] = (
+                tree.hex() if tree != _no_hash else "",
+                tuple(parent.hex() for parent in parents if parent != _no_hash),
+                timestamp, generation)
+
+    def _find(self, commit_hash: str):
+        """Returns the record of the commit, or None if the graph lacks it.
+        Children are always appended after their parents, so walking the history
+        from recent commits only ever parses the end of the file"""
+        self._refresh()
+        with open(self._path, 'rb') if self._parsed_from > _header.size else nullcontext() as f:
+            while commit_hash not in self._commits and self._parsed_from > _header.size:
+                start = max(_header.size, self._parsed_from - _scan_records * _record.size)
+                f.seek(start)
+                self._parse(f.read(self._parsed_from - start))
+                self._parsed_from = start
+        return self._commits.get(commit_hash)
+
+    def __contains__(self, commit_hash):
+        return self._find(commit_hash) is not None
+
+    def get(self, commit_hash: str):
+        """Returns (tree hash, parent hashes, timestamp, generation) of the commit,
+        adding it and its missing ancestors from the commit objects if needed"""
+        if self._find(commit_hash) is None:
+            self._add_missing(commit_hash)
+        return self._commits[commit_hash]
+
+    def parents(self, commit_hash: str):
+        return self.get(commit_hash)[1]
+
+    def generation(self, commit_hash: str):
+        return self.get(commit_hash)[3]
+
+    def add(self, commit_hash: str, commit: Commit):
+        """Appends the commit to the graph, its parents being added first if missing"""
+        parents = [parent for parent in commit.pchs if parent != "none"]
+        if len(parents) > max_parents:
+            raise ValueError(f'Error: commits have at most {max_parents} parents')
+        for parent in parents:
+            self.get(parent)
+
+        # a record of the commit would follow those of its parents, which are parsed
+        # by now, so a new commit is told apart without the rest of the file being read
+        self._refresh()
+        if commit_hash in self._commits:
+            return
+
+        generation = 1 + max([self._commits[parent][3] for parent in parents], default=0)
+        binary_parents = [bytes.fromhex(parent) for parent in parents]
+        binary_parents += [_no_hash] * (max_parents - len(binary_parents))
+        record = _record.pack(bytes.fromhex(commit_hash),
+                              bytes.fromhex(commit.tree_hash) if commit.tree_hash else _no_hash,
+                              *binary_parents, commit.timestamp, generation)
+
+        if not self._end:
+            with open(self._path, 'wb') as f:
+                f.write(_header.pack(graph_magic, graph_version))
+            self._parsed_from = self._end = _header.size
+        with open(self._path, 'r+b') as f:
+            # the part of a record an interrupted append left behind is written over
+            f.truncate(self._end)
+            f.seek(self._end)
+            f.write(record)
+        self._parse(record)
+        self._end += _record.size
+
+    def walk(self, start: str):
+        """Yields the hashes of the commits reachable from start, newest first.
+        The history is read lazily, as far as the caller goes"""
+        if start == "none":
+            return
+        _, _, timestamp, generation = self.get(start)
+        # children always precede their parents, even when committed within the same second
+        heap = [(-timestamp, -generation, start)]
+        seen = {start}
+        while heap:
+            _, _, current = heapq.heappop(heap)
+            yield current
+            for parent in self.parents(current):
+                if parent not in seen:
+                    seen.add(parent)
+                    _, _, timestamp, generation = self.get(parent)
+                    heapq.heappush(heap, (-timestamp, -generation, parent))
+
+    def _add_missing(self, commit_hash: str):
+        """Adds the commit written before the graph existed, with its ancestors,
+        reading their commit objects once, parents before children"""
+        stack = [commit_hash]
+        commits = {}
+        while stack:
+            current = stack[-1]
+            if current not in commits:
+                commits[current] = Commit.unhash(current, self._objects)
+                if commits[current] is None:
+                    raise ValueError(f'Error: {current} is not a commit')
+            missing = [parent for parent in commits[current].pchs if parent != "none"
+                       and parent not in commits and parent not in self]
+            if missing:
+                stack += missing
+                continue
+            stack.pop()
+            if current not in self:
+                self.add(current, commits[current])
+
+    def is_ancestor(self, ancestor: str, descendant: str) -> bool:
+        """Tells whether ancestor is reachable from descendant. Commits with a lower
+        generation than the ancestor cannot lead to it, so they are not walked"""
+        ancestor_generation = self.generation(ancestor)
+        seen = set()
+        stack = [descendant]
+        while stack:
+            current = stack.pop()
+            if current == ancestor:
+                return True
+            if current in seen or self.generation(current) <= ancestor_generation:
+                continue
+            seen.add(current)
+            stack += self.parents(current)
+        return False
+
+    def merge_base(self, first: str, second: str):
+        """Finds the lowest common ancestor of the commits, or None if they share no history.
+        Both histories are walked together, highest generation first, and the first commit
+        reached from both sides is the base"""
+        if first == second:
+            return first
+
+        reached = {first: {1}, second: {2}}
+        heap = [(-self.generation(first), first), (-self.generation(second), second)]
+        heapq.heapify(heap)
+        while heap:
+            _, current = heapq.heappop(heap)
+            sides = reached[current]
+            if sides == {1, 2}:
+                return current
+            for parent in self.parents(current):
+                if parent not in reached:
+                    reached[parent] = set()
+                    heapq.heappush(heap, (-self.generation(parent), parent))
+                reached[parent] |= sides
+        return None
@@ -0,0 +1,100 @@
+# A delta describes the target data as a sequence of operations on the base data:
+#   copy:   0x80 | varint offset | varint length - copies a slice of the base
+#   insert: length (1..127) | data               - inserts the data as is
+# preceded by the varint lengths of the base and of the target
+block_size = 16
+_max_insert = 0x7f
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _decode_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def _match_length(base, base_position, target, target_position):
+    """Length of the common run of base and target starting at the given positions"""
+    length = 0
+    step = 4096
+    limit = min(len(base) - base_position, len(target) - target_position)
+    # compare big slices first, then narrow down to the first differing byte
+    while step:
+        while length + step <= limit and \
+                base[base_position + length:base_position + length + step] == \
+                target[target_position + length:target_position + length + step]:
+            length += step
+        step //= 2
+    return length
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """Computes the delta turning base into target"""
+    blocks = {}
+    for position in range(0, len(base) - block_size + 1, block_size):
+        blocks.setdefault(base[position:position + block_size], position)
+
+    delta = [_encode_varint(len(base)), _encode_varint(len(target))]
+    insert_start = 0
+
+    def flush_insert(end):
+        for start in range(insert_start, end, _max_insert):
+            chunk = target[start:min(start + _max_insert, end)]
+            delta.append(bytes([len(chunk)]) + chunk)
+
+    position = 0
+    while position + block_size <= len(target):
+        base_position = blocks.get(target[position:position + block_size])
+        if base_position is None:
+            position += 1
+            continue
+
+        flush_insert(position)
+        length = _match_length(base, base_position, target, position)
+        delta.append(b'\x80' + _encode_varint(base_position) + _encode_varint(length))
+        position += length
+        insert_start = position
+
+    flush_insert(len(target))
+    return b''.join(delta)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuilds the target data from the base and the delta"""
+    base_size, position = _decode_varint(delta, 0)
+    target_size, position = _decode_varint(delta, position)
+    if base_size != len(base):
+        raise ValueError(f'Error: delta expects a base of {base_size} bytes, got {len(base)} bytes')
+
+    target = bytearray()
+    while position < len(delta):
+        operation = delta[position]
+        position += 1
+        if operation & 0x80:
+            offset, position = _decode_varint(delta, position)
+            length, position = _decode_varint(delta, position)
+            target += base[offset:offset + length]
+        else:
+            target += delta[position:position + operation]
+            position += operation
+
+    if len(target) != target_size:
+        raise ValueError(f'Error: expected {target_size} bytes, got {len(target)} bytes')
+    return bytes(target)
@@ -0,0 +1,383 @@
+import os
+from collections import Counter
+from math import isqrt
+from Files import unblobify, object_size, hash_file, encoding
+
+# files larger than this are reported without their lines being compared
+diff_size_limit = 1 << 20
+
+# a NUL byte among this many first bytes makes the file binary
+_binary_probe_size = 8000
+
+# a deleted and an added file sharing at least this percentage of their contents are a rename
+rename_threshold = 50
+
+# renames are only searched for among fewer pairs of deleted and added files than this,
+# files with identical contents being paired regardless
+rename_max_pairs = 1000 * 1000
+
+# the search for a minimal diff gives up on finding the shortest script
+# after at least this many edits, and lines repeated more than at least this
+# many times are not matched, see _max_cost and line_opcodes
+_min_max_cost = 64
+_min_max_repeats = 64
+
+# binary files are compared by blocks of this many bytes, text files by lines
+_similarity_block_size = 64
+
+
+def is_binary(data: bytes) -> bool:
+    """Tells whether the data is not text, as NUL bytes or invalid UTF-8 show"""
+    if b'\x00' in data[:_binary_probe_size]:
+        return True
+    try:
+        data.decode(encoding)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def _max_cost(n: int, m: int) -> int:
+    """How many edits the search for a middle snake may look through before it
+    settles for the furthest point reached, as xdiff does"""
+    return max(_min_max_cost, isqrt(n + m))
+
+
+def _middle_snake(a, a_low, a_high, b, b_low, b_high, max_cost=None):
+    """Finds the snake in the middle of a shortest edit script from a[a_low:a_high]
+    to b[b_low:b_high] by running Myers' greedy search from both ends at once.
+    Returns its start and end, relative to a_low and b_low.
+    After max_cost edits without the searches meeting, the point furthest along
+    either search is returned as an empty snake instead: the script is then no longer
+    the shortest, but the time taken stays proportional to the lines times max_cost"""
+    n = a_high - a_low
+    m = b_high - b_low
+    delta = n - m
+    odd = delta % 2 == 1
+    if max_cost is None:
+        max_cost = _max_cost(n, m)
+    max_d = min((n + m + 1) // 2, max_cost) + 1
+    offset = max_d + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(max_d):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start = (x, y)
+            while x < n and y < m and a[a_low + x] == b[b_low + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            c = delta - k
+            if odd and -(d - 1) <= c <= d - 1 and x + backward[offset + c] >= n:
+                return start, (x, y)
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            end = (n - x, m - y)
+            while x < n and y < m and a[a_high - 1 - x] == b[b_high - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            c = delta - k
+            if not odd and -d <= c <= d and x + forward[offset + c] >= n:
+                return (n - x, m - y), end
+
+        if d >= max_cost:
+            return _furthest_point(forward, backward, offset, d, n, m)
+
+    raise AssertionError("the searches from both ends always meet")
+
+
+def _furthest_point(forward, backward, offset, d, n, m):
+    """The point within the bounds of both sequences the search from either end
+    has gone furthest to after d edits, as an empty snake. Both searches have left
+    their corners by then, so the point splits the script into two shorter ones"""
+    best = None
+    best_progress = 0
+    for k in range(-d, d + 1, 2):
+        x = forward[offset + k]
+        y = x - k
+        if 0 <= x <= n and 0 <= y <= m and x + y > best_progress:
+            best, best_progress = (x, y), x + y
+        x = backward[offset + k]
+        y = x - k
+        if 0 <= x <= n and 0 <= y <= m and x + y > best_progress:
+            best, best_progress = (n - x, m - y), x + y
+    return best, best
+
+
+def _diff(a, a_low, a_high, b, b_low, b_high, matches):
+    """Appends the (a index, b index, length) blocks of equal lines
+    of a shortest edit script, in linear space"""
+    prefix = 0
+    while a_low + prefix < a_high and b_low + prefix < b_high and a[a_low + prefix] == b[b_low + prefix]:
+        prefix += 1
+    if prefix:
+        matches.append((a_low, b_low, prefix))
+        a_low += prefix
+        b_low += prefix
+
+    suffix = 0
+    while a_low < a_high - suffix and b_low < b_high - suffix and \
+            a[a_high - 1 - suffix] == b[b_high - 1 - suffix]:
+        suffix += 1
+
+    if a_low < a_high - suffix and b_low < b_high - suffix:
+        (x_start, y_start), (x_end, y_end) = _middle_snake(a, a_low, a_high - suffix, b, b_low, b_high - suffix)
+        _diff(a, a_low, a_low + x_start, b, b_low, b_low + y_start, matches)
+        if x_end > x_start:
+            matches.append((a_low + x_start, b_low + y_start, x_end - x_start))
+        _diff(a, a_low + x_end, a_high - suffix, b, b_low + y_end, b_high - suffix, matches)
+
+    if suffix:
+        matches.append((a_high - suffix, b_high - suffix, suffix))
+
+
+def line_opcodes(a: list, b: list) -> list:
+    """Lists the ("equal" | "replace" | "delete" | "insert", a start, a end, b start, b end)
+    operations turning the lines a into the lines b, the same way difflib does,
+    using Myers' algorithm for a minimal diff, given up on for a close one
+    when it takes too long"""
+    # lines are compared as small integers rather than as strings, and lines found
+    # on one side only, which can never match, are left out. So are lines repeated
+    # too many times, as xdiff does: they would make every step of the search
+    # follow them, and are shown as changed instead
+    numbers = {}
+    a_numbers = [numbers.setdefault(line, len(numbers)) for line in a]
+    b_numbers = [numbers.setdefault(line, len(numbers)) for line in b]
+    a_counts, b_counts = Counter(a_numbers), Counter(b_numbers)
+    limit = max(_min_max_repeats, isqrt(len(a) + len(b)))
+    common = {number for number in a_counts.keys() & b_counts.keys()
+              if a_counts[number] <= limit and b_counts[number] <= limit}
+    a_lines = [i for i, number in enumerate(a_numbers) if number in common]
+    b_lines = [j for j, number in enumerate(b_numbers) if number in common]
+
+    filtered_matches = []
+    _diff([a_numbers[i] for i in a_lines], 0, len(a_lines),
+          [b_numbers[j] for j in b_lines], 0, len(b_lines), filtered_matches)
+
+    # matching lines are adjacent in the filtered lines, but not always in the whole ones
+    matches = []
+    for a_start, b_start, length in filtered_matches:
+        for offset in range(length):
+            i, j = a_lines[a_start + offset], b_lines[b_start + offset]
+            if matches and matches[-1][0] + matches[-1][2] == i and matches[-1][1] + matches[-1][2] == j:
+                matches[-1] = (matches[-1][0], matches[-1][1], matches[-1][2] + 1)
+            else:
+                matches.append((i, j, 1))
+    matches.append((len(a), len(b), 0))
+
+    opcodes = []
+    i = j = 0
+    for a_start, b_start, length in matches:
+        if i < a_start or j < b_start:
+            tag = "replace" if i < a_start and j < b_start else "delete" if i < a_start else "insert"
+            opcodes.append((tag, i, a_start, j, b_start))
+        if length:
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], a_start + length, opcodes[-1][3], b_start + length)
+            else:
+                opcodes.append(("equal", a_start, a_start + length, b_start, b_start + length))
+        i, j = a_start + length, b_start + length
+    return opcodes
+
+
+def _hunk_range(start, end):
+    """Formats a range of lines the way unified diffs do"""
+    length = end - start
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start + 1 if length else start},{length}"
+
+
+def _grouped_opcodes(opcodes, context):
+    """Splits the operations into hunks around the changes, with context
+    equal lines on each side, the same way difflib does"""
+    if opcodes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if opcodes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # equal runs longer than twice the context end the hunk
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def unified_hunks(a: list, b: list, context=3):
+    """Yields the lines of the unified diff of the lines a and b, hunk by hunk"""
+    opcodes = line_opcodes(a, b)
+    if all(tag == "equal" for tag, *_ in opcodes):
+        return
+
+    for group in _grouped_opcodes(opcodes, context):
+        yield f"@@ -{_hunk_range(group[0][1], group[-1][2])} +{_hunk_range(group[0][3], group[-1][4])} @@"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                yield from (' ' + line for line in a[i1:i2])
+                continue
+            yield from ('-' + line for line in a[i1:i2])
+            yield from ('+' + line for line in b[j1:j2])
+
+
+def _size(version, target_directory):
+    kind, name = version
+    return os.path.getsize(name) if kind == "file" else object_size(name, target_directory)
+
+
+def _read(version, target_directory):
+    kind, name = version
+    if kind == "file":
+        with open(name, 'rb') as f:
+            return f.read()
+    return unblobify(name, target_directory)
+
+
+def _version_hash(version):
+    kind, name = version
+    return hash_file(name) if kind == "file" else name
+
+
+def _chunk_sizes(data: bytes) -> dict:
+    """Maps the hashes of the lines of the data, or of its blocks if it is binary,
+    to the number of bytes they take"""
+    if is_binary(data):
+        chunks = (data[i:i + _similarity_block_size] for i in range(0, len(data), _similarity_block_size))
+    else:
+        chunks = data.splitlines(keepends=True)
+    sizes = {}
+    for chunk in chunks:
+        key = hash(chunk)
+        sizes[key] = sizes.get(key, 0) + len(chunk)
+    return sizes
+
+
+def detect_renames(changes, target_directory, threshold=None, max_pairs=None):
+    """Turns the (filename, old version or None, new version or None) changes, versions being
+    ("blob", filehash) for stored files and ("file", path) for working copies, into
+    (old filename, new filename, old version, new version) ones, pairing deleted files
+    with the added files they were renamed to. Files with identical contents are paired
+    first; the rest are scored by the share of their lines found in one another,
+    the best pairs scoring at least threshold percent being taken"""
+    threshold = rename_threshold if threshold is None else threshold
+    max_pairs = rename_max_pairs if max_pairs is None else max_pairs
+
+    deleted = {filename: old for filename, old, new in changes if new is None}
+    added = {filename: new for filename, old, new in changes if old is None}
+    renames = {}
+
+    if deleted and added:
+        deleted_by_hash = {}
+        for filename in sorted(deleted):
+            deleted_by_hash.setdefault(_version_hash(deleted[filename]), []).append(filename)
+        for filename in sorted(added):
+            candidates = deleted_by_hash.get(_version_hash(added[filename]))
+            if candidates:
+                # among files with the same contents, the one with the same name is taken
+                same_name = [candidate for candidate in candidates
+                             if os.path.basename(candidate) == os.path.basename(filename)]
+                candidate = (same_name or candidates)[0]
+                candidates.remove(candidate)
+                renames[candidate] = filename
+
+    unpaired_deleted = sorted(filename for filename in deleted if filename not in renames)
+    unpaired_added = sorted(set(added) - set(renames.values()))
+    if unpaired_deleted and unpaired_added and len(unpaired_deleted) * len(unpaired_added) <= max_pairs:
+        sizes = {("old", filename): _size(deleted[filename], target_directory) for filename in unpaired_deleted}
+        sizes |= {("new", filename): _size(added[filename], target_directory) for filename in unpaired_added}
+        chunk_sizes = {}
+
+        def chunks_of(side, filename):
+            if (side, filename) not in chunk_sizes:
+                version = deleted[filename] if side == "old" else added[filename]
+                chunk_sizes[(side, filename)] = _chunk_sizes(_read(version, target_directory))
+            return chunk_sizes[(side, filename)]
+
+        scores = []
+        for old_filename in unpaired_deleted:
+            for new_filename in unpaired_added:
+                old_size, new_size = sizes[("old", old_filename)], sizes[("new", new_filename)]
+                largest = max(old_size, new_size)
+                # files of too different sizes cannot share enough, so they are not read
+                if not largest or min(old_size, new_size) * 100 < threshold * largest:
+                    continue
+                old_chunks, new_chunks = chunks_of("old", old_filename), chunks_of("new", new_filename)
+                shared = sum(min(size, new_chunks.get(key, 0)) for key, size in old_chunks.items())
+                score = shared * 100 // largest
+                if score >= threshold:
+                    scores.append((-score, old_filename, new_filename))
+
+        paired = set()
+        for _, old_filename, new_filename in sorted(scores):
+            if old_filename not in paired and new_filename not in paired:
+                renames[old_filename] = new_filename
+                paired |= {old_filename, new_filename}
+
+    renamed = set(renames.values())
+    result = []
+    for filename, old, new in changes:
+        if filename in renames:
+            result.append((filename, renames[filename], old, added[renames[filename]]))
+        elif filename not in renamed:
+            result.append((filename, filename, old, new))
+    return result
+
+
+def stat_lines(changes, target_directory):
+    """Yields a line per changed file naming the change and the sizes,
+    the files themselves being left unread. Changes are the
+    (old filename, new filename, old version or None, new version or None)
+    tuples detect_renames returns"""
+    for old_filename, new_filename, old, new in changes:
+        if old is None:
+            yield f"Added: {new_filename} ({_size(new, target_directory)} bytes)"
+        elif new is None:
+            yield f"Deleted: {old_filename} ({_size(old, target_directory)} bytes)"
+        elif old_filename != new_filename:
+            yield f"Renamed: {old_filename} -> {new_filename} " \
+                  f"({_size(old, target_directory)} -> {_size(new, target_directory)} bytes)"
+        else:
+            yield f"Changed: {new_filename} ({_size(old, target_directory)} -> {_size(new, target_directory)} bytes)"
+
+
+def diff_lines(changes, target_directory, size_limit=None, context=3):
+    """Yields the unified diff of the changes, taken as stat_lines does, line by line.
+    Only one file at a time is read; binary files and files larger than
+    size_limit bytes are named without their lines being compared"""
+    size_limit = diff_size_limit if size_limit is None else size_limit
+    for old_filename, new_filename, old, new in changes:
+        yield f"diff {old_filename}" if old_filename == new_filename else f"diff {old_filename} -> {new_filename}"
+        sizes = [_size(version, target_directory) for version in (old, new) if version]
+        if max(sizes) > size_limit:
+            yield f"File too large to compare ({max(sizes)} bytes)"
+            continue
+
+        old_data = _read(old, target_directory) if old else b''
+        new_data = _read(new, target_directory) if new else b''
+        if is_binary(old_data) or is_binary(new_data):
+            yield "Binary files differ"
+            continue
+
+        yield f"--- a/{old_filename}" if old else "--- /dev/null"
+        yield f"+++ b/{new_filename}" if new else "+++ /dev/null"
+        yield from unified_hunks(old_data.decode(encoding).splitlines(),
+                                 new_data.decode(encoding).splitlines(), context)
@@ -0,0 +1,96 @@
+import json
+import os
+from datetime import datetime
+from traceback import format_exception
+
+# Errors are appended to the log one JSON record per line:
+#   {"time": "2024-01-01 12:00:00", "type": "ValueError", "message": "...", "traceback": "..."}
+# Once the log grows past error_log_max_size it is renamed to error.log.1, the
+# older error.log.1 to error.log.2 and so on, keeping error_log_backups of them
+error_log_max_size = 1 << 20
+error_log_backups = 3
+
+_block_size = 1 << 13
+
+
+def _rotated(path: str, number: int) -> str:
+    return f"{path}.{number}" if number else path
+
+
+def _rotate(path: str, backups: int):
+    if backups <= 0:
+        os.remove(path)
+        return
+    for number in range(backups - 1, -1, -1):
+        try:
+            os.replace(_rotated(path, number), _rotated(path, number + 1))
+        except FileNotFoundError:
+            pass
+
+
+def log_error(path: str, exc_type, exc_value, exc_traceback,
+              max_size=None, backups=None):
+    """Appends the exception to the log at path, rotating the log first if it is full"""
+    max_size = error_log_max_size if max_size is None else max_size
+    backups = error_log_backups if backups is None else backups
+
+    record = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "type": exc_type.__name__,
+        "message": str(exc_value),
+        "traceback": ''.join(format_exception(exc_type, exc_value, exc_traceback)),
+    }
+    line = (json.dumps(record) + '\n').encode('utf-8')
+
+    try:
+        if os.path.getsize(path) + len(line) > max_size:
+            _rotate(path, backups)
+    except FileNotFoundError:
+        pass
+
+    # a single write to a file opened for appending is not interleaved with those of other processes
+    with open(path, 'ab') as f:
+        f.write(line)
+
+
+def _lines_from_end(path: str):
+    """Yields the lines of the file, last first, reading it backwards block by block"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b''
+        while position > 0:
+            size = min(_block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + rest).split(b'\n')
+            # the first line may begin in the block before
+            rest = lines.pop(0)
+            yield from reversed(lines)
+        yield rest
+
+
+def read_errors(path: str, count=None, backups=None):
+    """Yields up to count records of the log at path and of its rotated logs, newest first.
+    Only as much of the logs is read as the records take"""
+    backups = error_log_backups if backups is None else backups
+    if count is not None and count <= 0:
+        return
+
+    for number in range(backups + 1):
+        for line in _lines_from_end(_rotated(path, number)):
+            # the blocks of text logs older versions wrote are skipped
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            yield record
+            if count is not None:
+                count -= 1
+                if not count:
+                    return
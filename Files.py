@@ -1,9 +1,33 @@
 import os
+import tempfile
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
+from Chunker import read_chunks
+from Delta import make_delta, apply_delta
+from ObjectCache import ObjectCache
+from Pack import find_packed, open_packs, close_packs, pack_directory, \
+    pack_header, pack_header_size, index_data
 
 encoding = "utf-8"
 
+# files larger than this are hashed and compressed in chunks of this size
+# rather than being read into memory whole
+chunk_size = 1 << 20
+
+# files of at least this many bytes are stored as a list of content-defined chunks,
+# each chunk being an object of its own, so that versions of a large file sharing
+# most of their contents share most of their objects. None, the default, stores every
+# file whole: cutting chunks runs in Python, several times slower than compressing
+chunked_file_size = None
+
+# longest chain of deltas repack builds before storing an object whole
+delta_max_depth = 10
+
+# decoded objects are kept up to this many bytes, so that objects read
+# several times in one command, delta bases included, are decompressed once
+object_cache = ObjectCache(64 << 20)
+
 
 def create_file_tree(tree, prefix):
     for name in tree:
@@ -17,31 +41,134 @@ def create_file_tree(tree, prefix):
             create_file_tree(tree[name], path)
 
 
-def match_files(path):
-    if not os.path.exists(path):
-        return []
+def walk_files(path, ignore=None, root=None):
+    """Yields (filename, stat signature) of the file at path or of every file
+    under the directory at path, as the directories are listed. The walk keeps
+    a stack of the directories to be listed rather than recursing, and takes
+    the stat data from scandir; the files and whole directories the IgnoreRules
+    ignore are skipped, and symbolic links to directories are not followed.
+    Given a root, path and the filenames are relative to it"""
+    full_path = os.path.join(root, path) if root else path
+    if os.path.isfile(full_path):
+        yield path, stat_signature(full_path)
+        return
+    if not os.path.isdir(full_path):
+        return
 
-    elif os.path.isfile(path):
-        return [path]
+    # directories are paired with their paths relative to the root of the IgnoreRules;
+    # the files of the current directory are named without a leading "./"
+    stack = [(path, (ignore.relative(full_path) or None) if ignore else None)]
+    while stack:
+        directory, prefix = stack.pop()
+        with os.scandir(os.path.join(root, directory) if root else directory) as entries:
+            for entry in entries:
+                if entry.name == ".gym":
+                    continue
+                is_directory = entry.is_dir(follow_symlinks=False)
+                relative_path = _join_path(prefix, entry.name) if ignore else None
+                if ignore and ignore.ignored(relative_path, is_directory):
+                    continue
+                if directory == os.curdir:
+                    entry_path = entry.name
+                else:
+                    entry_path = os.path.join(directory, entry.name) if root else entry.path
+                if is_directory:
+                    stack.append((entry_path, relative_path))
+                elif entry.is_file():
+                    yield entry_path, _entry_signature(entry)
+
+
+def match_files(path, ignore=None):
+    """Lists the files walk_files finds at path"""
+    return [filename for filename, _ in walk_files(path, ignore)]
+
+
+def write_tree(tree, target_directory, write=True):
+    """Stores the nested tree { name: filehash or subtree, ... } as tree objects,
+    one per directory, and returns the hash of the root one. Unchanged subtrees
+    hash the same as before and are not written again.
+    With write=False the hash is only computed"""
+    lines = []
+    for name in sorted(tree):
+        if isinstance(tree[name], str):
+            lines.append(f'blob {tree[name]} {name}')
+        else:
+            lines.append(f'tree {write_tree(tree[name], target_directory, write)} {name}')
+
+    data = '\n'.join(lines).encode(encoding)
+    return blobify(data, target_directory) if write else sha1(data).hexdigest()
 
-    elif os.path.isdir(path):
-        files = []
-        for child in os.listdir(path):
-            if child == ".gym":
-                continue
-            files += match_files(os.path.join(path, child))
-        return files
 
+def read_tree(tree_hash, target_directory):
+    """Reads the tree object into a dictionary of form { name: (kind, hash), ... }.
+    Trees of older commits list every "filename filehash" flat and read as blobs"""
+    if not tree_hash:
+        return {}
 
-def write_tree(tree):
-    tree_string = ""
-    for key in tree:
-        if isinstance(tree[key], str):
-            tree_string += f'blob {tree[key]} {key}\n'
+    entries = {}
+    for line in unblobify(tree_hash, target_directory).decode(encoding).split('\n'):
+        fields = line.split(' ', 2)
+        if len(fields) == 3 and fields[0] in ("blob", "tree"):
+            entries[fields[2]] = (fields[0], fields[1])
+        elif line.strip():
+            filename, filehash = line.strip().split(' ')
+            entries[filename] = ("blob", filehash)
+    return entries
+
+
+def _join_path(prefix, name):
+    return name if prefix is None else f'{prefix}/{name}'
+
+
+def flatten_tree(tree_hash, target_directory, prefix=None):
+    """Converts the tree to a dictionary of form { filename: filehash, ... }"""
+    files = {}
+    for name, (kind, obj_hash) in read_tree(tree_hash, target_directory).items():
+        path = _join_path(prefix, name)
+        if kind == "tree":
+            files.update(flatten_tree(obj_hash, target_directory, path))
         else:
-            subtree = write_tree(tree[key])
-            tree_string += f'tree {subtree} {key}\n'
-    return tree_string
+            files[path] = obj_hash
+    return files
+
+
+def diff_trees(from_tree_hash, to_tree_hash, target_directory, prefix=None):
+    """Lists the files that differ between the trees as sorted
+    (filename, from filehash or None, to filehash or None) tuples.
+    Subtrees with equal hashes are skipped without being read"""
+    if from_tree_hash == to_tree_hash:
+        return []
+
+    from_entries = read_tree(from_tree_hash, target_directory)
+    to_entries = read_tree(to_tree_hash, target_directory)
+
+    # flat trees of older commits name files by their whole paths
+    if any('/' in name for name in list(from_entries) + list(to_entries)):
+        from_files = flatten_tree(from_tree_hash, target_directory, prefix)
+        to_files = flatten_tree(to_tree_hash, target_directory, prefix)
+        return [(filename, from_files.get(filename), to_files.get(filename))
+                for filename in sorted(from_files.keys() | to_files.keys())
+                if from_files.get(filename) != to_files.get(filename)]
+
+    changes = []
+    for name in sorted(from_entries.keys() | to_entries.keys()):
+        from_entry = from_entries.get(name)
+        to_entry = to_entries.get(name)
+        if from_entry == to_entry:
+            continue
+
+        path = _join_path(prefix, name)
+        from_blob = from_entry[1] if from_entry and from_entry[0] == "blob" else None
+        to_blob = to_entry[1] if to_entry and to_entry[0] == "blob" else None
+        if from_blob != to_blob:
+            changes.append((path, from_blob, to_blob))
+
+        # a name may have been a file on one side and a directory on the other
+        from_subtree = from_entry[1] if from_entry and from_entry[0] == "tree" else ""
+        to_subtree = to_entry[1] if to_entry and to_entry[0] == "tree" else ""
+        changes += diff_trees(from_subtree, to_subtree, target_directory, path)
+
+    return sorted(changes)
 
 
 def unflatten_tree(flat_tree):
@@ -69,58 +196,432 @@ def add_to_filename(filepath, addition):
     return os.path.join(filename_current[0], temp)
 
 
-def blobify(data, target_directory):
+def stat_signature(path):
+    """Returns the (mtime, size, inode, ctime) tuple the index keeps
+    for the file to tell whether it has changed since it was hashed,
+    or None if the file does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns
+
+
+def _entry_signature(entry):
+    """The stat_signature of a scandir entry, which stats the file once"""
+    st = entry.stat()
+    return st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns
+
+
+def hash_file(path):
+    """Returns the hash the file is stored under, reading it in chunks"""
+    digest = sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan_directory(directory, prefix, ignore=None):
+    """Lists the files of a single directory with their stat signatures,
+    and its subdirectories to be scanned next"""
+    files = {}
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            path = _join_path(prefix, entry.name)
+            is_directory = entry.is_dir(follow_symlinks=False)
+            if ignore and ignore.ignored(path, is_directory):
+                continue
+            if is_directory:
+                if entry.name != ".gym":
+                    subdirectories.append((entry.path, path))
+            elif entry.is_file():
+                files[path] = _entry_signature(entry)
+    return files, subdirectories
+
+
+def scan_files(directory=".", jobs=None, ignore=None):
+    """Returns every file under the directory, the repository itself and what the
+    IgnoreRules ignore excluded, as a dictionary of form { filename: stat signature, ... }.
+    The directories of each level are listed concurrently, the stat data coming from scandir"""
+    files = {}
+    level = [(directory, None)]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while level:
+            next_level = []
+            for level_files, subdirectories in pool.map(lambda d: _scan_directory(*d, ignore), level):
+                files.update(level_files)
+                next_level += subdirectories
+            level = next_level
+    return files
+
+
+def write_atomically(path, data, fsync=False):
+    """Writes data (bytes or an iterable of bytes chunks) to a temporary file
+    next to path and renames it into place, so that readers never see
+    a partially written file"""
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            for chunk in [data] if isinstance(data, bytes) else data:
+                f.write(chunk)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner alone
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def object_exists(obj_hash, target_directory):
+    """Tells whether the object is stored in target_directory, loose or packed"""
+    return os.path.exists(os.path.join(target_directory, obj_hash[:2], obj_hash[2:])) \
+        or find_packed(obj_hash, target_directory) is not None
+
+
+def blobify(data, target_directory, fsync=False):
     """Creates a blob object from data, creates child directory
-    in target_directory and a file in it, where in writes the data"""
+    in target_directory and a file in it, where in writes the data.
+    Objects already present in target_directory are not written again"""
     # создаем объектный хэш из данных
     obj_hash = sha1(data).hexdigest()
 
     # разбиваем хэш на каталоги и имя файла
     directory = obj_hash[:2]
     filename = obj_hash[2:]
+    object_directory = os.path.join(target_directory, directory)
+    object_filename = os.path.join(object_directory, filename)
+
+    # объект с таким хэшем уже записан - сжимать и писать нечего
+    if object_exists(obj_hash, target_directory):
+        return obj_hash
 
     # создаем каталог, если он не существует
-    object_directory = os.path.join(target_directory, directory)
     os.makedirs(object_directory, exist_ok=True)
 
-    # создаем новый файл в объектном каталоге
-    object_filename = os.path.join(object_directory, filename)
-    with open(object_filename, 'wb') as f:
-        # сжимаем данные zlib
-        compressed_data = zlib.compress(data)
-        # записываем заголовок объека
-        header = f'blob {len(data)}\0'.encode(encoding)
-        # записываем заголовок, данные и сжатый размер
-        f.write(header)
-        f.write(compressed_data)
+    # сжимаем данные zlib
+    compressed_data = zlib.compress(data)
+    # записываем заголовок объека
+    header = f'blob {len(data)}\0'.encode(encoding)
+    # записываем заголовок и сжатые данные через временный файл
+    write_atomically(object_filename, header + compressed_data, fsync)
 
     # возвращаем хэш созданного объекта
     return obj_hash
 
 
-def unblobify(obj_hash, target_directory):
-    """From a hash of the object gets the names of directory and file
-    inside target_directory, where it searches for file"""
+def blobify_file(path, target_directory, fsync=False, previous=None, chunked_size=None):
+    """Creates a blob object from the file at path. Small files are read once
+    and passed to blobify, large ones are hashed in a first pass and, only if
+    the object is missing, compressed chunk by chunk into the object file.
+    Files of chunked_size bytes or more, chunked_file_size by default, are stored by
+    blobify_chunked, previous being the hash of the version of the file stored before, if any"""
+    size = os.path.getsize(path)
+    chunked_size = chunked_file_size if chunked_size is None else chunked_size
+    if chunked_size is not None and size >= chunked_size:
+        try:
+            previous_chunks = chunk_list(previous, target_directory) if previous else None
+        except FileNotFoundError:
+            previous_chunks = None
+        return blobify_chunked(path, target_directory, previous_chunks, fsync)
+    if size <= chunk_size:
+        with open(path, 'rb') as f:
+            return blobify(f.read(), target_directory, fsync)
 
-    # разбиваем хэш на каталоги и имя файла
-    directory = obj_hash[:2]
-    filename = obj_hash[2:]
+    obj_hash = hash_file(path)
+
+    object_directory = os.path.join(target_directory, obj_hash[:2])
+    object_filename = os.path.join(object_directory, obj_hash[2:])
+    if object_exists(obj_hash, target_directory):
+        return obj_hash
+    os.makedirs(object_directory, exist_ok=True)
+
+    def compressed_chunks():
+        compressor = zlib.compressobj()
+        content_hash = sha1()
+        yield f'blob {size}\0'.encode(encoding)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                content_hash.update(chunk)
+                yield compressor.compress(chunk)
+        yield compressor.flush()
+        # the file must not have changed between the two passes
+        if content_hash.hexdigest() != obj_hash:
+            raise ValueError(f'Error: {path} changed while being stored')
+
+    write_atomically(object_filename, compressed_chunks(), fsync)
+    return obj_hash
+
+
+def blobify_chunked(path, target_directory, previous_chunks=None, fsync=False):
+    """Stores the file at path as content-defined chunks, each a blob object,
+    and a "chunks" object listing them, named by the hash of the whole file.
+    previous_chunks are the (chunk hash, size) of an earlier version of the file:
+    chunks of it found unchanged at the start of the file are only verified,
+    without being cut or compressed again"""
+    content_hash = sha1()
+    chunks = []
+    with open(path, 'rb') as f:
+        # chunks are cut where they would be cut anew, so the earlier ones still match;
+        # the last one ended with the file rather than at a cut point, so it is cut again
+        for chunk_hash, size in (previous_chunks or [])[:-1]:
+            data = f.read(size)
+            if sha1(data).hexdigest() != chunk_hash:
+                f.seek(-len(data), os.SEEK_CUR)
+                break
+            content_hash.update(data)
+            chunks.append((chunk_hash, size))
+
+        for data in read_chunks(f):
+            content_hash.update(data)
+            chunks.append((blobify(data, target_directory, fsync), len(data)))
+
+    obj_hash = content_hash.hexdigest()
+    if object_exists(obj_hash, target_directory):
+        return obj_hash
+
+    object_directory = os.path.join(target_directory, obj_hash[:2])
+    os.makedirs(object_directory, exist_ok=True)
+    listing = '\n'.join(f"{chunk_hash} {size}" for chunk_hash, size in chunks).encode(encoding)
+    header = f'chunks {sum(size for _, size in chunks)}\0'.encode(encoding)
+    write_atomically(os.path.join(object_directory, obj_hash[2:]), header + zlib.compress(listing), fsync)
+    return obj_hash
+
+
+def chunk_list(obj_hash, target_directory):
+    """Returns the (chunk hash, size) of the chunks of a "chunks" object,
+    or None if the object is stored otherwise"""
+    f, length = _open_object(obj_hash, target_directory)
+    with f:
+        start = f.tell()
+        header = _read_header(f).split()
+        if header[0] != "chunks":
+            return None
+        return _parse_chunk_list(zlib.decompress(f.read(length - (f.tell() - start))))
+
+
+def _parse_chunk_list(listing):
+    return [(chunk_hash, int(size)) for chunk_hash, size in
+            (line.split() for line in listing.decode(encoding).split('\n') if line)]
+
+
+def _read_header(f):
+    """Reads the object header from the beginning of the file,
+    leaving the file positioned at the start of the compressed data"""
+    header = b''
+    while not header.endswith(b'\x00'):
+        byte = f.read(1)
+        if not byte:
+            raise ValueError('Error: object header is not terminated')
+        header += byte
+    return header[:-1].strip().decode(encoding)
+
+
+def _open_object(obj_hash, target_directory):
+    """Opens the file holding the object, looking in the packs first
+    and falling back to the loose object. Returns the file positioned
+    at the object header and the number of bytes the object takes"""
+    packed = find_packed(obj_hash, target_directory)
+    if packed:
+        pack_path, offset, length = packed
+        f = open(pack_path, 'rb')
+        f.seek(offset)
+        return f, length
 
     # находим путь к файлу объекта
-    object_filename = os.path.join(target_directory, directory, filename)
+    object_filename = os.path.join(target_directory, obj_hash[:2], obj_hash[2:])
+    f = open(object_filename, 'rb')
+    return f, os.fstat(f.fileno()).st_size
+
+
+def unblobify_to_file(obj_hash, target_directory, destination):
+    """Decompresses the object straight into the destination file
+    chunk by chunk, never holding the whole data in memory"""
+    f, length = _open_object(obj_hash, target_directory)
+
+    with f, open(destination, 'wb') as out:
+        end = f.tell() + length
+        header = _read_header(f).split()
+        if header[0] == "delta":
+            # a delta is applied to the whole base, so there is nothing to stream
+            out.write(unblobify(obj_hash, target_directory))
+            return
+        if header[0] == "chunks":
+            for chunk_hash, _ in _parse_chunk_list(zlib.decompress(f.read(end - f.tell()))):
+                out.write(unblobify(chunk_hash, target_directory))
+            return
+
+        expected_size = int(header[1])
+        decompressor = zlib.decompressobj()
+        written = 0
+        for compressed_chunk in iter(lambda: f.read(min(chunk_size, end - f.tell())), b''):
+            data = decompressor.decompress(compressed_chunk, chunk_size)
+            while data:
+                out.write(data)
+                written += len(data)
+                data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+        data = decompressor.flush()
+        out.write(data)
+        written += len(data)
+
+    if written != expected_size:
+        raise ValueError(f'Error: expected {expected_size} bytes, got {written} bytes')
+
+
+def object_size(obj_hash, target_directory):
+    """Returns the size of the object data, reading only its header"""
+    cached = object_cache.get((target_directory, obj_hash))
+    if cached is not None:
+        return len(cached)
 
-    # считываем данные из файла объекта
-    with open(object_filename, 'rb') as f:
-        header, compressed_data = f.read().split(b"\x00", 1)
+    f, _ = _open_object(obj_hash, target_directory)
+    with f:
+        return int(_read_header(f).split()[1])
 
-    header = header.strip().decode(encoding)
+
+def unblobify(obj_hash, target_directory):
+    """From a hash of the object finds it in the packs inside target_directory,
+    or else gets the names of directory and file, where it searches for file.
+    Decoded objects are kept in object_cache"""
+
+    cached = object_cache.get((target_directory, obj_hash))
+    if cached is not None:
+        return cached
+
+    # считываем данные объекта из пака или из файла объекта
+    f, length = _open_object(obj_hash, target_directory)
+    with f:
+        header, compressed_data = f.read(length).split(b"\x00", 1)
+
+    header = header.strip().decode(encoding).split()
 
     # распаковываем сжатые данные
     data = zlib.decompress(compressed_data)
 
+    # packed deltas name their base after the size
+    if header[0] == "delta":
+        data = apply_delta(unblobify(header[2], target_directory), data)
+    # chunked files list their chunks
+    elif header[0] == "chunks":
+        data = b''.join(unblobify(chunk_hash, target_directory) for chunk_hash, _ in _parse_chunk_list(data))
+
     # проверяем, что распакованные данные имеют нужный размер
-    expected_size = int(header.split()[1])
+    expected_size = int(header[1])
     if len(data) != expected_size:
         raise ValueError(f'Error: expected {expected_size} bytes, got {len(data)} bytes')
 
+    object_cache.put((target_directory, obj_hash), data, len(data))
     return data
+
+
+def _loose_objects(target_directory):
+    """Yields (hash, path) of every loose object in target_directory"""
+    for directory in sorted(os.listdir(target_directory)):
+        directory_path = os.path.join(target_directory, directory)
+        if len(directory) != 2 or not os.path.isdir(directory_path):
+            continue
+        for filename in sorted(os.listdir(directory_path)):
+            if len(filename) == 38 and not filename.startswith("."):
+                yield directory + filename, os.path.join(directory_path, filename)
+
+
+def _read_raw(location, length=None):
+    """Reads the stored object, or only its first length bytes"""
+    path, offset, object_length = location
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(object_length if length is None else min(length, object_length))
+
+
+def _deltify(objects, delta_bases, target_directory, max_depth):
+    """Computes the packed deltas of the objects. delta_bases maps object hashes
+    to the hashes of the objects they should be stored against, each base having
+    been seen before the object it is the base of, so that no cycles arise"""
+    deltas = {}
+    depths = {}
+    for obj_hash, base_hash in delta_bases.items():
+        if obj_hash not in objects or base_hash not in objects or obj_hash == base_hash:
+            continue
+        depth = depths.get(base_hash, 0) + 1
+        if depth > max_depth:
+            continue
+        # chunked files already share their chunks with the other versions
+        if _read_raw(objects[obj_hash], 6) == b'chunks' or _read_raw(objects[base_hash], 6) == b'chunks':
+            continue
+
+        data = unblobify(obj_hash, target_directory)
+        delta = zlib.compress(make_delta(unblobify(base_hash, target_directory), data))
+        header = f'delta {len(data)} {base_hash}\0'.encode(encoding)
+        # a delta only pays off if it is smaller than the object stored whole
+        if len(header) + len(delta) < objects[obj_hash][2]:
+            deltas[obj_hash] = header + delta
+            depths[obj_hash] = depth
+    return deltas
+
+
+def repack(target_directory, delta_bases=None, max_depth=delta_max_depth, fsync=False):
+    """Writes every loose and packed object of target_directory into a single
+    pack with its index, then removes the loose objects and the old packs.
+    Objects are stored as deltas against their delta_bases where that is smaller,
+    in chains no longer than max_depth.
+    Returns the path of the new pack and the number of objects in it"""
+    old_packs = open_packs(target_directory)
+
+    # { hash: (path of the file holding the object, offset, length), ... }
+    objects = {}
+    for pack_path, index in old_packs:
+        for obj_hash, offset, length in index.entries():
+            objects.setdefault(obj_hash, (pack_path, offset, length))
+    loose_objects = list(_loose_objects(target_directory))
+    for obj_hash, path in loose_objects:
+        objects.setdefault(obj_hash, (path, 0, os.path.getsize(path)))
+
+    if not objects:
+        return None, 0
+
+    deltas = _deltify(objects, delta_bases or {}, target_directory, max_depth)
+
+    hashes = sorted(objects)
+    pack_name = "pack-" + sha1(''.join(hashes).encode(encoding)).hexdigest()
+    directory = pack_directory(target_directory)
+    os.makedirs(directory, exist_ok=True)
+    pack_path = os.path.join(directory, pack_name + ".pack")
+
+    records = []
+
+    def pack_chunks():
+        offset = pack_header_size
+        yield pack_header(len(hashes))
+        for obj_hash in hashes:
+            data = deltas.get(obj_hash) or _read_raw(objects[obj_hash])
+            # deltas of the old packs are not kept, their chains being rebuilt anew
+            if obj_hash not in deltas and data.startswith(b'delta'):
+                whole = unblobify(obj_hash, target_directory)
+                data = f'blob {len(whole)}\0'.encode(encoding) + zlib.compress(whole)
+            records.append((obj_hash, offset, len(data)))
+            offset += len(data)
+            yield data
+
+    # the new pack is written under a temporary name while the old ones are read
+    if pack_path not in [path for path, _ in old_packs] or deltas:
+        write_atomically(pack_path, pack_chunks(), fsync)
+        # the index goes last: a pack without one is never looked into
+        write_atomically(pack_path[:-len(".pack")] + ".idx", index_data(records), fsync)
+
+    close_packs(target_directory)
+    for old_pack_path, _ in old_packs:
+        if old_pack_path != pack_path:
+            os.remove(old_pack_path[:-len(".pack")] + ".idx")
+            os.remove(old_pack_path)
+
+    for _, path in loose_objects:
+        os.remove(path)
+        object_directory = os.path.dirname(path)
+        if not os.listdir(object_directory):
+            os.rmdir(object_directory)
+
+    return pack_path, len(hashes)
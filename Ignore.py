@@ -0,0 +1,136 @@
+import os
+import re
+
+# Every directory of the working directory may hold a .gymignore file of
+# gitignore-style patterns, one per line, matched against the paths relative
+# to that directory:
+#   # comment            blank lines and lines starting with "#" are skipped
+#   *.pyc                a pattern with no "/" matches a name at any depth
+#   /build               a leading or inner "/" anchors it to the directory
+#   cache/               a trailing "/" only matches directories
+#   docs/**/*.tmp        "**" matches any number of directories
+#   !keep.pyc            "!" includes again what an earlier pattern excluded
+# The last pattern matching a path decides, and the .gymignore files of deeper
+# directories decide before those of their parents. Nothing inside an ignored
+# directory is looked at, so it cannot be included again
+ignore_file_name = ".gymignore"
+
+
+def _translate(pattern: str) -> str:
+    """Turns a pattern, stripped of its "!" and of its trailing "/", into a regular expression"""
+    anchored = '/' in pattern
+    if pattern.startswith('/'):
+        pattern = pattern[1:]
+
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += '/.*'
+            i += 3
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            characters = pattern[i + 1:end].replace('\\', '\\\\')
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            regex += f'[{characters}]'
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+
+    return regex if anchored else '(?:.*/)?' + regex
+
+
+class _Patterns:
+    """The patterns of a single .gymignore file, compiled into one regular expression
+    for files and one for directories. The alternatives are listed last pattern first,
+    so the one that matches is the pattern that decides"""
+
+    def __init__(self, lines):
+        patterns = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated or line.startswith('\\!') or line.startswith('\\#'):
+                line = line[1:]
+            directory_only = line.endswith('/')
+            line = line.rstrip('/')
+            if line:
+                patterns.append((_translate(line), negated, directory_only))
+
+        self._files = self._compile([pattern for pattern in patterns if not pattern[2]])
+        self._directories = self._compile(patterns)
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None, []
+        patterns = patterns[::-1]
+        regex = re.compile('|'.join(f'({pattern})' for pattern, _, _ in patterns), re.DOTALL)
+        return regex, [negated for _, negated, _ in patterns]
+
+    def __bool__(self):
+        return self._directories[0] is not None
+
+    def match(self, path: str, is_directory: bool):
+        """Returns True if the path is ignored, False if it is included again,
+        or None if no pattern matches it"""
+        regex, negations = self._directories if is_directory else self._files
+        if regex is None:
+            return None
+        match = regex.fullmatch(path)
+        if match is None:
+            return None
+        return not negations[match.lastindex - 1]
+
+
+class IgnoreRules:
+    """The .gymignore files of the working directory at root, each read and compiled
+    the first time a path below its directory is looked up"""
+
+    def __init__(self, root="."):
+        self._root = root
+        # { directory relative to root ("" for the root): patterns or None, ... }
+        self._patterns = {}
+
+    def _patterns_of(self, directory: str):
+        if directory not in self._patterns:
+            try:
+                with open(os.path.join(self._root, directory, ignore_file_name), 'r') as f:
+                    patterns = _Patterns(f.read().split('\n'))
+            except (FileNotFoundError, NotADirectoryError):
+                patterns = None
+            self._patterns[directory] = patterns or None
+        return self._patterns[directory]
+
+    def relative(self, path: str) -> str:
+        """Turns the path into the "/"-separated path relative to root that ignored takes"""
+        relative_path = os.path.relpath(path, self._root).replace(os.sep, '/')
+        return "" if relative_path == "." else relative_path
+
+    def ignored(self, path: str, is_directory=False) -> bool:
+        """Tells whether the "/"-separated path relative to root is ignored.
+        Its parent directories are not looked at: the walk never enters ignored ones"""
+        parts = path.split('/')
+        for depth in range(len(parts) - 1, -1, -1):
+            patterns = self._patterns_of('/'.join(parts[:depth]))
+            if patterns:
+                result = patterns.match('/'.join(parts[depth:]), is_directory)
+                if result is not None:
+                    return result
+        return False
@@ -0,0 +1,201 @@
+import mmap
+import struct
+from hashlib import sha1
+from Files import encoding, write_atomically
+
+# The index lists the files to be committed, sorted by path:
+#   b"GYMI" | version | entry count | offset table | entry | entry | ... | checksum
+# where the offset table gives the position of every entry in the file, and each
+# entry is the binary file hash, the stat signature (zeroes when there is none)
+# and the length of the path, followed by the path itself.
+# The checksum is the sha1 of everything before it
+index_magic = b"GYMI"
+index_version = 1
+
+_header = struct.Struct(">4sII")
+_offset = struct.Struct(">I")
+_entry = struct.Struct(">20sQQQQH")
+_checksum_size = 20
+_no_signature = (0, 0, 0, 0)
+
+
+def _parse_text(index_content: str) -> dict:
+    """Parses the "filename filehash [mtime size inode ctime]" lines older versions wrote"""
+    entries = {}
+    for line in index_content.split('\n'):
+        fields = line.split()
+        if not fields:
+            continue
+        signature = tuple(map(int, fields[2:6])) if len(fields) == 6 else None
+        entries[fields[0]] = (fields[1], signature)
+    return entries
+
+
+def _pack_entry(path: bytes, filehash: str, signature) -> bytes:
+    return _entry.pack(bytes.fromhex(filehash), *(signature or _no_signature), len(path)) + path
+
+
+class Index:
+    """The index, memory-mapped and looked up by binary search over its sorted paths,
+    so that a single entry is found without the whole index being parsed.
+    Indices written as text by older versions are parsed whole instead"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._map = None
+        self._count = 0
+        self._text_entries = {}
+
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(index_magic)) != index_magic:
+                    f.seek(0)
+                    self._text_entries = _parse_text(f.read().decode(encoding))
+                    self._text_paths = sorted(self._text_entries)
+                    self._count = len(self._text_entries)
+                    return
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self._text_paths = []
+            return
+
+        magic, version, self._count = _header.unpack_from(self._map, 0)
+        if version != index_version:
+            self.close()
+            raise ValueError(f'Error: {path} is an index of unknown version {version}')
+        with memoryview(self._map) as data:
+            checksum = sha1(data[:-_checksum_size]).digest()
+        if checksum != self._map[-_checksum_size:]:
+            self.close()
+            raise ValueError(f'Error: {path} is corrupt')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry_offset(self, position):
+        return _offset.unpack_from(self._map, _header.size + position * _offset.size)[0]
+
+    def _path_at(self, position) -> bytes:
+        offset = self._entry_offset(position)
+        path_length = _entry.unpack_from(self._map, offset)[-1]
+        return self._map[offset + _entry.size:offset + _entry.size + path_length]
+
+    def _entry_at(self, position):
+        filehash, *signature, _ = _entry.unpack_from(self._map, self._entry_offset(position))
+        signature = tuple(signature)
+        return filehash.hex(), signature if signature != _no_signature else None
+
+    def _position(self, path: bytes):
+        """Returns the position of the first entry whose path is not less than path"""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._path_at(middle) < path:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, path: str, default=None):
+        """Returns (filehash, stat signature or None) of the file, or default"""
+        if self._map is None:
+            return self._text_entries.get(path, default)
+
+        binary_path = path.encode(encoding)
+        position = self._position(binary_path)
+        if position < self._count and self._path_at(position) == binary_path:
+            return self._entry_at(position)
+        return default
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __iter__(self):
+        if self._map is None:
+            yield from self._text_paths
+            return
+        for position in range(self._count):
+            yield self._path_at(position).decode(encoding)
+
+    def items(self):
+        """Yields (filename, (filehash, stat signature or None)) in the order of the paths"""
+        if self._map is None:
+            for path in self._text_paths:
+                yield path, self._text_entries[path]
+            return
+        for position in range(self._count):
+            yield self._path_at(position).decode(encoding), self._entry_at(position)
+
+    def _packed_entries(self):
+        """Yields (binary path, packed entry) as stored, without decoding them"""
+        if self._map is None:
+            for path in self._text_paths:
+                binary_path = path.encode(encoding)
+                yield binary_path, _pack_entry(binary_path, *self._text_entries[path])
+            return
+        for position in range(self._count):
+            offset = self._entry_offset(position)
+            path_length = _entry.unpack_from(self._map, offset)[-1]
+            yield self._map[offset + _entry.size:offset + _entry.size + path_length], \
+                self._map[offset:offset + _entry.size + path_length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def _index_data(packed_entries: list) -> bytes:
+    """Lays the packed entries, sorted by path, out as an index file"""
+    offsets = []
+    position = _header.size + len(packed_entries) * _offset.size
+    for packed_entry in packed_entries:
+        offsets.append(_offset.pack(position))
+        position += len(packed_entry)
+
+    data = _header.pack(index_magic, index_version, len(packed_entries)) \
+        + b''.join(offsets) + b''.join(packed_entries)
+    return data + sha1(data).digest()
+
+
+def write_index(path: str, entries: dict):
+    """Writes the index of form { filename: (filehash, stat signature or None), ... }"""
+    binary_entries = sorted((filename.encode(encoding), entry) for filename, entry in entries.items())
+    data = _index_data([_pack_entry(filename, *entry) for filename, entry in binary_entries])
+    write_atomically(path, data)
+
+
+def update_index(path: str, changes: dict):
+    """Rewrites the index with the changed entries of form
+    { filename: (filehash, stat signature or None) or None to remove it, ... }.
+    The other entries are copied as they are stored, without being decoded"""
+    binary_changes = sorted((filename.encode(encoding), entry) for filename, entry in changes.items())
+
+    packed_entries = []
+    with Index(path) as index:
+        position = 0
+        for binary_path, packed_entry in index._packed_entries():
+            while position < len(binary_changes) and binary_changes[position][0] < binary_path:
+                changed_path, entry = binary_changes[position]
+                if entry:
+                    packed_entries.append(_pack_entry(changed_path, *entry))
+                position += 1
+            if position < len(binary_changes) and binary_changes[position][0] == binary_path:
+                changed_path, entry = binary_changes[position]
+                if entry:
+                    packed_entries.append(_pack_entry(changed_path, *entry))
+                position += 1
+                continue
+            packed_entries.append(packed_entry)
+
+        for changed_path, entry in binary_changes[position:]:
+            if entry:
+                packed_entries.append(_pack_entry(changed_path, *entry))
+
+    write_atomically(path, _index_data(packed_entries))
@@ -0,0 +1,44 @@
+from difflib import SequenceMatcher
+
+
+def _matches(base: list, other: list) -> dict:
+    """Maps the indices of base lines to the indices of the same lines in other"""
+    matches = {}
+    for base_start, other_start, size in SequenceMatcher(None, base, other, autojunk=False).get_matching_blocks():
+        for offset in range(size):
+            matches[base_start + offset] = other_start + offset
+    return matches
+
+
+def merge_lines(base: list, ours: list, theirs: list):
+    """Merges the changes both sides made to the base lines (diff3).
+    The lines left unchanged on both sides split the files into chunks; a chunk
+    changed on one side only is taken from that side, a chunk changed the same
+    way on both sides is taken once. Returns the merged lines, or None if both
+    sides changed some chunk differently"""
+    ours_matches = _matches(base, ours)
+    theirs_matches = _matches(base, theirs)
+    # both mappings only ever go forward, so their common lines are in order on all sides
+    stable_lines = sorted(ours_matches.keys() & theirs_matches.keys())
+
+    merged = []
+    base_position = ours_position = theirs_position = 0
+    for base_end in stable_lines + [len(base)]:
+        ours_end = ours_matches.get(base_end, len(ours))
+        theirs_end = theirs_matches.get(base_end, len(theirs))
+
+        base_chunk = base[base_position:base_end]
+        ours_chunk = ours[ours_position:ours_end]
+        theirs_chunk = theirs[theirs_position:theirs_end]
+        if ours_chunk == base_chunk:
+            merged += theirs_chunk
+        elif theirs_chunk == base_chunk or ours_chunk == theirs_chunk:
+            merged += ours_chunk
+        else:
+            return None
+
+        if base_end < len(base):
+            merged.append(base[base_end])
+        base_position, ours_position, theirs_position = base_end + 1, ours_end + 1, theirs_end + 1
+
+    return merged
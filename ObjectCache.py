@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class ObjectCache:
+    """Least recently used cache of decoded objects, bounded by their total size in bytes.
+    Objects never change once written, so entries are never invalidated, only evicted"""
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, capacity: int):
+        with self._lock:
+            self._capacity = capacity
+            self._evict()
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached value or None, counting the hit or the miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int):
+        """Caches the value taking size bytes; values bigger than the whole cache are skipped"""
+        if size > self._capacity:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "size": self._size, "capacity": self._capacity}
+
+    def _evict(self):
+        while self._size > self._capacity:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
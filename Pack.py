@@ -0,0 +1,150 @@
+import mmap
+import os
+import re
+import struct
+
+# Pack files keep many objects in a single file, each object stored exactly
+# as its loose file would be (header and compressed data), one after another:
+#   b"GYMP" | version | object count | object | object | ...
+# Next to every pack lies its index, sorted by object hash:
+#   b"GYMX" | version | object count | fan-out table | records
+# where fan-out[b] is the number of objects whose hash starts with a byte <= b,
+# and each record is the binary hash, the offset and the length of the object
+pack_directory_name = "pack"
+pack_magic = b"GYMP"
+index_magic = b"GYMX"
+pack_version = 1
+
+_object_hash = re.compile(r"[0-9a-f]{40}")
+
+_pack_header = struct.Struct(">4sII")
+_index_header = struct.Struct(">4sII")
+_fanout = struct.Struct(">256I")
+_record = struct.Struct(">20sQQ")
+
+pack_header_size = _pack_header.size
+
+
+class PackIndex:
+    """Memory-mapped index of a pack file, looked up by binary search"""
+
+    def __init__(self, index_path: str):
+        self._file = open(index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._count = _index_header.unpack_from(self._map, 0)
+        if magic != index_magic or version != pack_version:
+            raise ValueError(f'Error: {index_path} is not a pack index')
+
+        self._fanout = _fanout.unpack_from(self._map, _index_header.size)
+        self._records_offset = _index_header.size + _fanout.size
+
+    def __len__(self):
+        return self._count
+
+    def _hash_at(self, position):
+        offset = self._records_offset + position * _record.size
+        return self._map[offset:offset + 20]
+
+    def find(self, obj_hash: str):
+        """Returns (offset, length) of the object inside the pack, or None"""
+        binary_hash = bytes.fromhex(obj_hash)
+        first_byte = binary_hash[0]
+        low = self._fanout[first_byte - 1] if first_byte else 0
+        high = self._fanout[first_byte]
+
+        while low < high:
+            middle = (low + high) // 2
+            middle_hash = self._hash_at(middle)
+            if middle_hash < binary_hash:
+                low = middle + 1
+            elif middle_hash > binary_hash:
+                high = middle
+            else:
+                _, offset, length = _record.unpack_from(
+                    self._map, self._records_offset + middle * _record.size)
+                return offset, length
+        return None
+
+    def entries(self):
+        """Yields (hash, offset, length) of every object in the pack"""
+        for position in range(self._count):
+            binary_hash, offset, length = _record.unpack_from(
+                self._map, self._records_offset + position * _record.size)
+            yield binary_hash.hex(), offset, length
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# opened pack indices of every object directory,
+# reopened whenever the pack directory changes
+_packs = {}
+
+
+def pack_directory(target_directory):
+    return os.path.join(target_directory, pack_directory_name)
+
+
+def open_packs(target_directory):
+    """Returns (pack path, index) of every pack in the object directory"""
+    directory = pack_directory(target_directory)
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    cached = _packs.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    close_packs(target_directory)
+
+    packs = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".idx"):
+            pack_path = os.path.join(directory, name[:-len(".idx")] + ".pack")
+            packs.append((pack_path, PackIndex(os.path.join(directory, name))))
+    _packs[directory] = (mtime, packs)
+    return packs
+
+
+def find_packed(obj_hash, target_directory):
+    """Returns (pack path, offset, length) of the packed object, or None.
+    Names that are not object hashes, such as mistyped commits, are never found"""
+    if not isinstance(obj_hash, str) or not _object_hash.fullmatch(obj_hash):
+        return None
+    for pack_path, index in open_packs(target_directory):
+        location = index.find(obj_hash)
+        if location:
+            return pack_path, location[0], location[1]
+    return None
+
+
+def close_packs(target_directory):
+    """Closes the opened indices of the packs in the object directory"""
+    cached = _packs.pop(pack_directory(target_directory), None)
+    if cached:
+        for _, index in cached[1]:
+            index.close()
+
+
+def pack_header(count):
+    return _pack_header.pack(pack_magic, pack_version, count)
+
+
+def index_data(records):
+    """Encodes the index of a pack from its (hash, offset, length) records"""
+    records = sorted(records)
+    fanout = [0] * 256
+    for obj_hash, _, _ in records:
+        fanout[int(obj_hash[:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    data = [_index_header.pack(index_magic, pack_version, len(records)), _fanout.pack(*fanout)]
+    data += [_record.pack(bytes.fromhex(obj_hash), offset, length)
+             for obj_hash, offset, length in records]
+    return b''.join(data)
+
@@ -0,0 +1,804 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import islice
+from Files import *
+from Commit import Commit
+from Diff import stat_lines, diff_lines, detect_renames
+from Index import Index, write_index, update_index
+from Ignore import IgnoreRules
+from ErrorLog import read_errors
+from CommitGraph import CommitGraph
+from Merge import merge_lines
+from GymException import GymException
+
+repository_directory = ".gym"
+repository_structure = {
+    "HEAD": "ref: refs/branch/boss",
+    "objects": {},
+    "backups": {},
+    "refs": {
+        "branch": {"boss": "hash: none"},
+        "tag": {}
+    },
+    "index": "",
+    "error.log": "",
+    ".commits": ""
+}
+
+
+class Repository:
+    """The gym repository whose working directory is at path. Every path it reads or
+    writes is found from its own, so that a process may work on several repositories
+    at once, one thread per repository, without changing its working directory.
+    The operations return what they did rather than printing it, and raise
+    GymException for anything the user is to be told. Filenames are relative to path"""
+
+    def __init__(self, path="."):
+        self.path = path
+        self.directory = os.path.join(path, repository_directory)
+        if not os.path.isdir(self.directory):
+            raise GymException(f"{os.path.abspath(path)} is not a gym repository.")
+
+        self.index = os.path.join(self.directory, "index")
+        self.backup_index = os.path.join(self.directory, "backups", "index")
+        self.head = os.path.join(self.directory, "HEAD")
+        self.log_file = os.path.join(self.directory, "error.log")
+        self.objects = os.path.join(self.directory, "objects")
+        self.commit_graph = os.path.join(self.directory, "commit-graph")
+        self.merge_head = os.path.join(self.directory, "MERGE_HEAD")
+        self._commits = os.path.join(self.directory, ".commits")
+
+        # the commit graph, brought up to date on every access
+        self._graph = CommitGraph(self.commit_graph, self.objects)
+        # (stat signature of the index, its entries) as last read
+        self._index_entries = None
+
+    @staticmethod
+    def init(path="."):
+        """Creates a gym repository in the directory at path and returns it"""
+        if os.path.exists(os.path.join(path, repository_directory)):
+            raise GymException("Already a gym repository.")
+
+        os.makedirs(os.path.join(path, repository_directory))
+        create_file_tree(repository_structure, os.path.join(path, repository_directory))
+        return Repository(path)
+
+    def _file(self, filename: str) -> str:
+        """Where the file of the working directory is, relative to the current directory"""
+        return os.path.join(self.path, filename)
+
+    def _ref(self, name: str, reftype: str) -> str:
+        return os.path.join(self.directory, "refs", reftype, os.path.split(name)[1])
+
+    # the index
+
+    def _read_index(self) -> dict:
+        """Reads the index into a dictionary of form
+        { filename: (filehash, stat signature or None), ... },
+        parsing it again only once it has changed"""
+        self._ensure_index()
+        # every write replaces the index file, so the signature tells whether it changed
+        signature = stat_signature(self.index)
+        if self._index_entries is None or self._index_entries[0] != signature:
+            with Index(self.index) as index:
+                self._index_entries = (signature, dict(index.items()))
+        return dict(self._index_entries[1])
+
+    def _write_index(self, entries: dict):
+        """Writes the index and its backup. Entries modified no earlier than
+        the index itself are 'racy': a change within the same timestamp tick
+        would go unnoticed, so their stat data is dropped to force a rehash"""
+        write_index(self.index, entries)
+
+        racy = self._racy_entries(entries)
+        if racy:
+            for path in racy:
+                entries[path] = (entries[path][0], None)
+            write_index(self.index, entries)
+        self._backup_index()
+
+    def _update_index(self, changes: dict):
+        """Changes the given entries of the index, None removing the entry,
+        and leaves the other ones as they are stored. Racy entries are handled
+        the same way as by _write_index"""
+        self._ensure_index()
+        update_index(self.index, changes)
+
+        racy = self._racy_entries(changes)
+        if racy:
+            update_index(self.index, {path: (changes[path][0], None) for path in racy})
+        self._backup_index()
+
+    def _racy_entries(self, entries: dict) -> list:
+        index_mtime = os.stat(self.index).st_mtime_ns
+        return [path for path, entry in entries.items()
+                if entry and entry[1] and entry[1][0] >= index_mtime]
+
+    def _backup_index(self):
+        os.makedirs(os.path.dirname(self.backup_index), exist_ok=True)
+        with open(self.index, 'rb') as index:
+            write_atomically(self.backup_index, index.read())
+
+    def _ensure_index(self) -> bool:
+        """Restores the index from its backup if it was deleted. Returns True
+        if the backup was deleted as well, the index being left empty"""
+        if os.path.exists(self.index):
+            return False
+
+        if os.path.exists(self.backup_index):
+            with open(self.backup_index, 'rb') as backup:
+                write_atomically(self.index, backup.read())
+            return False
+
+        open(self.index, 'w').close()
+        return True
+
+    def _index(self) -> str:
+        """Returns the index in the form commit trees are stored in,
+        that is "filename filehash" lines without the stat data"""
+        entries = self._read_index()
+        return str.join('\n', [f"{path} {entries[path][0]}" for path in sorted(entries)])
+
+    def _index_to_tree(self, write=True):
+        """Stores the index as tree objects, one per directory, and returns the hash
+        of the root tree. With write=False the hash is only computed"""
+        entries = self._read_index()
+        flat_tree = {filename: entries[filename][0] for filename in entries}
+
+        nested_tree = unflatten_tree(flat_tree)
+
+        return write_tree(nested_tree, self.objects, write)
+
+    def _index_matches_tree(self, tree_hash: str) -> bool:
+        """Tells whether the index lists the same files as the commit tree.
+        Trees of older commits are flat, so they are compared file by file"""
+        if self._index_to_tree(write=False) == tree_hash:
+            return True
+        entries = self._read_index()
+        return flatten_tree(tree_hash, self.objects) == \
+            {filename: entries[filename][0] for filename in entries}
+
+    def _index_cull(self):
+        """Removes the entries of the files deleted from the working directory"""
+        self._ensure_index()
+        with Index(self.index) as index:
+            deleted = {path: None for path in index if not os.path.exists(self._file(path))}
+        if deleted:
+            self._update_index(deleted)
+
+    def _is_modified(self, path, entry) -> bool:
+        """Tells whether the file in the working directory differs from its index entry.
+        The file is only read and hashed when its stat data does not match"""
+        filehash, signature = entry
+        current_signature = stat_signature(self._file(path))
+        if current_signature is None:
+            return False
+        if signature == current_signature:
+            return False
+        return hash_file(self._file(path)) != filehash
+
+    def _has_uncommitted_changes(self, tree_hash: str) -> bool:
+        """Tells whether the index differs from the commit tree
+        or any indexed file was modified in the working directory"""
+        if not self._index_matches_tree(tree_hash):
+            return True
+
+        entries = self._read_index()
+        return any(self._is_modified(path, entries[path]) for path in entries)
+
+    def _restore(self, files: dict):
+        """Writes the files of form { filename: filehash, ... } to the working directory
+        on a thread pool, the directories being created once beforehand.
+        Failures are collected and reported together once every file was tried"""
+        for filedir in sorted({os.path.dirname(filename) for filename in files} - {""}):
+            os.makedirs(self._file(filedir), exist_ok=True)
+
+        def restore(file):
+            try:
+                unblobify_to_file(file[1], self.objects, self._file(file[0]))
+            # a corrupt object is reported along with the rest rather than alone
+            except Exception as e:
+                return f"{file[0]}: {e}"
+
+        with ThreadPoolExecutor() as pool:
+            errors = [error for error in pool.map(restore, files.items()) if error]
+        if errors:
+            raise GymException("Could not restore some of the files:\n" + '\n'.join(errors))
+
+    # refs
+
+    def head_commit(self, detached_ok=True) -> str:
+        """Returns the hash of the commit HEAD points to, "none" before the first commit"""
+        with open(self.head, 'r') as head:
+            curr_head = head.read().split(": ")
+            if curr_head[0] == "ref":
+                with open(self._ref(curr_head[1], reftype="branch"), 'r') as branch_head:
+                    cur_commit_hash = branch_head.read().split(": ")[1]
+
+            elif curr_head[0] == "hash":
+                if not detached_ok:
+                    raise GymException("DETACHED HEAD state found. Aborting.")
+                cur_commit_hash = curr_head[1]
+        return cur_commit_hash
+
+    def _create_ref(self, ref, commit_hash):
+        with open(os.path.join(self.directory, "refs", ref), 'w') as f:
+            f.write(f"hash: {commit_hash}")
+
+    def _is_branch(self, name: str) -> bool:
+        path1 = os.path.join(self.directory, "refs", "branch", name)
+        path2 = os.path.join(self.directory, "refs", name)
+        return os.path.exists(path1) or \
+               (name.startswith("branch") and os.path.exists(path2))
+
+    def _is_tag(self, name: str) -> bool:
+        path1 = os.path.join(self.directory, "refs", "tag", name)
+        path2 = os.path.join(self.directory, "refs", name)
+        return os.path.exists(path1) or \
+               (name.startswith("tag") and os.path.exists(path2))
+
+    def _ref_commit_hashes(self) -> list:
+        """Returns the hashes of the commits HEAD, the branches and the tags point to"""
+        commit_hashes = [self.head_commit()]
+        for reftype in ("branch", "tag"):
+            for name in sorted(os.listdir(os.path.join(self.directory, "refs", reftype))):
+                with open(self._ref(name, reftype), 'r') as ref:
+                    commit_hashes.append(ref.read().split(": ")[1])
+        return [commit_hash for commit_hash in commit_hashes if commit_hash != "none"]
+
+    def resolve(self, name: str) -> str:
+        """Returns the hash of the commit the branch or tag points to,
+        or the name itself if it is neither"""
+        for reftype, is_ref in (("branch", self._is_branch), ("tag", self._is_tag)):
+            if is_ref(name):
+                with open(self._ref(name, reftype=reftype), 'r') as ref:
+                    return ref.read().split(": ")[1]
+        return name
+
+    def branch(self, name: str) -> str:
+        """Creates a branch on the current commit and returns the hash of the commit"""
+        pch = self.head_commit(detached_ok=True)
+        self._create_ref(f"branch/{name}", pch)
+        return pch
+
+    def tag(self, name: str) -> str:
+        """Tags the current commit and returns its hash"""
+        pch = self.head_commit(detached_ok=True)
+        self._create_ref(f"tag/{name}", pch)
+        return pch
+
+    # commands
+
+    def add(self, path: str, jobs=None, chunked_size=None) -> list:
+        """Adds the current changes of the file or directory to the commit index.
+        Files are hashed and stored by a pool of jobs workers (CPU count by default),
+        files of chunked_size bytes or more as content-defined chunks.
+        Returns the (filename, filehash) of every file matched"""
+        if jobs is not None and jobs < 1:
+            raise GymException("\"gym add\" needs at least one job")
+        if chunked_size is not None and chunked_size < 1:
+            raise GymException("--chunked needs a size of at least one byte")
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.path)
+
+        # the index is looked up file by file and rewritten once for the whole batch
+        self._ensure_index()
+        changes = {}
+        added = []
+
+        # sha1 and zlib release the GIL on large buffers, so threads
+        # read, hash, compress and write the objects concurrently.
+        # Files stream from the walk into the pool, a bounded number of them
+        # being in flight; the results are taken in order and the index is updated here alone
+        workers = jobs or os.cpu_count()
+        with Index(self.index) as index, ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+
+            def take_oldest():
+                file, signature, filehash = pending.popleft()
+                if isinstance(filehash, Future):
+                    filehash = filehash.result()
+                    changes[file] = (filehash, signature)
+                added.append((file, filehash))
+
+            # stat is taken by the walk before reading, so a change made while hashing
+            # makes the entry mismatch the next time instead of being missed.
+            # Files whose stat data matches the index are neither read nor hashed
+            for file, signature in walk_files(path, IgnoreRules(self.path), self.path):
+                entry = index.get(file)
+                if entry and entry[1] == signature:
+                    pending.append((file, signature, entry[0]))
+                else:
+                    # large files reuse the chunks of the version added before
+                    pending.append((file, signature, pool.submit(
+                        blobify_file, self._file(file), self.objects,
+                        previous=entry[0] if entry else None, chunked_size=chunked_size)))
+                if len(pending) > 4 * workers:
+                    take_oldest()
+            while pending:
+                take_oldest()
+
+        if not added:
+            raise GymException(f"Error: {path} matched no files")
+
+        if changes:
+            self._update_index(changes)
+        return added
+
+    def commit(self, message: str) -> dict:
+        """Creates a new commit of the index. Returns a dictionary of form
+        { "commit": hash, "parents": [hash, ...], "changes": [(from filename, to filename,
+        from version or None, to version or None), ...] }, the changes being listed
+        the way detect_renames lists them. Only files moved unchanged are listed as renamed,
+        so that no file is read for the summary"""
+        prev_commit_hash = self.head_commit()
+
+        # a merge in progress makes the merged commit the second parent
+        merge_parents = []
+        if os.path.exists(self.merge_head):
+            with open(self.merge_head, 'r') as merge_head:
+                merge_parents.append(merge_head.read().strip())
+
+        self._index_cull()
+
+        prev_tree_hash = Commit.unhash(prev_commit_hash, self.objects).tree_hash
+        if prev_commit_hash != "none" and not merge_parents:
+            if self._index_matches_tree(prev_tree_hash):
+                raise GymException("Nothing to commit, aborting")
+
+        # as an intended side effect, write_tree creates the tree objects of
+        # the directories that changed, the unchanged ones being already stored
+        tree_hash = self._index_to_tree()
+
+        new_commit = Commit(message, tree_hash, [prev_commit_hash] + merge_parents, directory=self.objects)
+
+        # as the last time, blobify creates a blob object in the objects directory
+        new_commit_hash = new_commit.blobify()
+        self._graph.add(new_commit_hash, new_commit)
+
+        with open(self.head, 'r') as head:
+            curr_head = head.read().split(": ")
+        if curr_head[0] == "hash":
+            with open(self.head, 'w') as head:
+                head.write(f"hash: {new_commit_hash}")
+        elif curr_head[0] == "ref":
+            with open(self._ref(curr_head[1], reftype="branch"), 'w') as ref:
+                ref.write(f"hash: {new_commit_hash}")
+
+        if merge_parents:
+            os.remove(self.merge_head)
+
+        with open(self._commits, 'a') as commits:
+            commits.write(f"hash: {new_commit_hash}\n")
+            commits.write(str(new_commit))
+            commits.write('\n' + '-' * 20 + '\n')
+
+        return {"commit": new_commit_hash, "parents": new_commit.pchs,
+                "changes": Commit._changes(prev_tree_hash, tree_hash, self.objects, max_pairs=0)}
+
+    def status(self, jobs=None) -> dict:
+        """Compares the working directory, the index and the tree of HEAD without
+        writing anything. Returns a dictionary of form
+        { "staged": [(change, filename), ...], "modified": [...], "deleted": [...], "untracked": [...] }.
+        Only the files whose stat data does not match the index are read and hashed"""
+        entries = self._read_index()
+
+        staged = []
+        head_tree_hash = Commit.unhash(self.head_commit(), self.objects).tree_hash
+        if self._index_to_tree(write=False) != head_tree_hash:
+            head_files = flatten_tree(head_tree_hash, self.objects)
+            for filename in sorted(head_files.keys() | entries.keys()):
+                if filename not in entries:
+                    staged.append(("Deleted", filename))
+                elif filename not in head_files:
+                    staged.append(("Added", filename))
+                elif head_files[filename] != entries[filename][0]:
+                    staged.append(("Changed", filename))
+
+        working_files = scan_files(self.path, jobs=jobs, ignore=IgnoreRules(self.path))
+        indexed_files = {os.path.normpath(filename): filename for filename in entries}
+
+        deleted = []
+        to_hash = []
+        for path, filename in indexed_files.items():
+            # files added before they were ignored are still tracked
+            signature = working_files[path] if path in working_files else stat_signature(self._file(filename))
+            if signature is None:
+                deleted.append(filename)
+            elif signature != entries[filename][1]:
+                to_hash.append(filename)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            filehashes = pool.map(hash_file, map(self._file, to_hash))
+            modified = [filename for filename, filehash in zip(to_hash, filehashes)
+                        if filehash != entries[filename][0]]
+
+        untracked = [path for path in working_files if path not in indexed_files]
+
+        return {"staged": staged, "modified": sorted(modified),
+                "deleted": sorted(deleted), "untracked": sorted(untracked)}
+
+    def _working_versions(self) -> dict:
+        """Maps every indexed file present in the working directory to its hash and
+        where it is to be read from, the object if the file matches the index"""
+        versions = {}
+        for filename, entry in self._read_index().items():
+            if not os.path.exists(self._file(filename)):
+                continue
+            if self._is_modified(filename, entry):
+                versions[filename] = (hash_file(self._file(filename)), ("file", self._file(filename)))
+            else:
+                versions[filename] = (entry[0], ("blob", entry[0]))
+        return versions
+
+    def changes(self, targets=(), rename_threshold=None) -> list:
+        """Lists the changes between the index and the working directory, between
+        a commit and the working directory or between two commits, as
+        (from filename, to filename, from version or None, to version or None)
+        the way detect_renames lists them"""
+        if len(targets) > 2:
+            raise GymException("\"gym diff\" compares at most two commits")
+        if rename_threshold is not None and not 0 <= rename_threshold <= 100:
+            raise GymException("--rename-threshold is a percentage")
+
+        commit_files = []
+        for target in targets:
+            try:
+                commit = Commit.unhash(self.resolve(target), self.objects)
+            except (FileNotFoundError, ValueError):
+                commit = None
+            if commit is None:
+                raise GymException(f"No such commit: {target}")
+            commit_files.append({filename: (filehash, ("blob", filehash))
+                                 for filename, filehash in commit.files.items()})
+
+        if len(commit_files) == 2:
+            old_files, new_files = commit_files
+        else:
+            old_files = commit_files[0] if commit_files else \
+                {filename: (entry[0], ("blob", entry[0])) for filename, entry in self._read_index().items()}
+            new_files = self._working_versions()
+
+        changes = [(filename, old_files[filename][1] if filename in old_files else None,
+                    new_files[filename][1] if filename in new_files else None)
+                   for filename in sorted(old_files.keys() | new_files.keys())
+                   if old_files.get(filename, (None,))[0] != new_files.get(filename, (None,))[0]]
+        return detect_renames(changes, self.objects, rename_threshold)
+
+    def diff(self, targets=(), stat=False, size_limit=None, rename_threshold=None):
+        """Yields the lines of the unified diff of the changes, or with stat only
+        the names of the changed files along with their sizes"""
+        if size_limit is not None and size_limit < 0:
+            raise GymException("--size-limit cannot be negative")
+
+        changes = self.changes(targets, rename_threshold)
+        return stat_lines(changes, self.objects) if stat else diff_lines(changes, self.objects, size_limit)
+
+    def checkout(self, target: str, force=False) -> dict:
+        """Checks out on the commit (if hash given) or branch/tag (if name given).
+        Returns a dictionary of form { "commit": hash, "detached": whether HEAD is detached }"""
+        pch = self.head_commit(detached_ok=True)
+        prev_tree_hash = Commit.unhash(pch, self.objects).tree_hash
+
+        # if there are uncommitted changes and no --force is present,
+        # discard
+        has_uncommitted_changes = self._has_uncommitted_changes(prev_tree_hash)
+        if has_uncommitted_changes and not force:
+            raise GymException("Uncommitted changes found, aborting.\n"
+                               "In order to checkout regardless, use "
+                               "\"gym checkout -f/--force [name/hash]\"")
+
+        # if for some reason there are branch and tag with the same name,
+        # clarifications needed, so discard
+        mode = "hash"
+        if self._is_branch(target):
+            mode = "branch"
+        if self._is_tag(target):
+            if mode == "branch":
+                raise GymException(f"Ambiguous referencing:\n"
+                                   f"{target} is both a name of a tag and a branch.\n"
+                                   f"Specify using \"branch/{target}\" or \"tag/{target}\"")
+            mode = "tag"
+
+        match mode:
+            # when checkouting a commit, using its hash,
+            # try to unblobify the commit, entering DETACHED HEAD state
+            case "hash":
+                try:
+                    target_commit = Commit.unhash(target, self.objects)
+                except FileNotFoundError:
+                    raise GymException("No such commit, aborting")
+                target_commit_hash = target
+                head_content = f"hash: {target}"
+
+            # when checkouting a tag, open the tag file, extract the commit hash,
+            # then unblobify the commit, entering DETACHED HEAD state
+            case "tag":
+                try:
+                    with open(self._ref(target, reftype="tag"), 'r') as tag:
+                        target_commit_hash = tag.read().split(": ")[1]
+                except FileNotFoundError:
+                    raise GymException("No such tag, aborting")
+
+                target_commit = Commit.unhash(target_commit_hash, self.objects)
+                head_content = f"hash: {target_commit_hash}"
+
+            # when checkouting a branch, open the branch file, extract commit hash,
+            # then unblobify the commit and point head at the branch
+            case "branch":
+                try:
+                    with open(self._ref(target, reftype="branch"), 'r') as branch:
+                        target_commit_hash = branch.read().split(": ")[1]
+                except FileNotFoundError:
+                    raise GymException("No such branch, aborting")
+
+                target_commit = Commit.unhash(target_commit_hash, self.objects)
+                head_content = f"ref: refs/branch/{os.path.split(target)[1]}"
+
+        # noinspection PyUnboundLocalVariable
+        with open(self.head, 'w') as head:
+            head.write(head_content)
+
+        # noinspection PyUnboundLocalVariable
+        self._switch_working_tree(prev_tree_hash, target_commit.tree_hash,
+                                  discard=has_uncommitted_changes)
+
+        # checking out elsewhere abandons a merge in progress
+        if os.path.exists(self.merge_head):
+            os.remove(self.merge_head)
+
+        return {"commit": target_commit_hash, "detached": mode != "branch"}
+
+    def _switch_working_tree(self, from_tree_hash: str, to_tree_hash: str, discard=False):
+        """Turns the working directory and the index from one commit tree into another,
+        touching only the files whose hashes differ, found without visiting identical
+        subtrees. Unchanged files, their mtimes and their index entries with the stat
+        data are left as they are. With discard, the index and the working copies may
+        differ from the first tree, so every indexed file is compared with the target"""
+        entries = self._read_index()
+
+        if discard:
+            to_files = flatten_tree(to_tree_hash, self.objects)
+            # modified and missing working copies never match the target
+            current_files = {filename: "" if not os.path.exists(self._file(filename)) or
+                             self._is_modified(filename, entry) else entry[0]
+                             for filename, entry in entries.items()}
+            changes = [(filename, current_files.get(filename), to_files.get(filename))
+                       for filename in sorted(current_files.keys() | to_files.keys())
+                       if current_files.get(filename) != to_files.get(filename)]
+        else:
+            changes = diff_trees(from_tree_hash, to_tree_hash, self.objects)
+
+        files_to_restore = {}
+        for filepath, _, filehash in changes:
+            if filehash:
+                files_to_restore[filepath] = filehash
+                continue
+
+            entries.pop(filepath, None)
+            if os.path.exists(self._file(filepath)):
+                os.remove(self._file(filepath))
+            filedir = os.path.dirname(filepath)
+            if filedir and os.path.isdir(self._file(filedir)) and not os.listdir(self._file(filedir)):
+                os.rmdir(self._file(filedir))
+
+        self._restore(files_to_restore)
+        for filepath, filehash in files_to_restore.items():
+            entries[filepath] = (filehash, stat_signature(self._file(filepath)))
+
+        self._write_index(entries)
+
+    def merge(self, branch: str) -> dict:
+        """Merges the branch onto HEAD. Returns a dictionary of form
+        { "up_to_date": bool, "commit": what commit returned, or None,
+        "conflicts": [filename, ...] }. Conflicting files are left to be resolved, their
+        versions kept as name_current and name_incoming, or under both new names for a file
+        the sides renamed differently, and the merge is only committed when there are none"""
+        current_commit_hash = self.head_commit(detached_ok=False)
+        try:
+            with open(self._ref(branch, reftype="branch")) as branch_head:
+                incoming_commit_hash = branch_head.read().split(": ")[1]
+        except FileNotFoundError:
+            raise GymException(f"No such branch: {branch}")
+
+        current_commit = Commit.unhash(current_commit_hash, self.objects)
+        incoming_commit = Commit.unhash(incoming_commit_hash, self.objects)
+
+        # if there are uncommitted changes, discard: the incoming versions
+        # are written over the working copies
+        if self._has_uncommitted_changes(current_commit.tree_hash):
+            raise GymException("Uncommitted changes found, aborting.\n"
+                               "There is no merging regardless, take it or leave it.")
+
+        up_to_date = {"up_to_date": True, "commit": None, "conflicts": []}
+        if incoming_commit_hash == "none":
+            return up_to_date
+        base_commit_hash = self._graph.merge_base(current_commit_hash, incoming_commit_hash) \
+            if current_commit_hash != "none" else None
+        if base_commit_hash == incoming_commit_hash:
+            return up_to_date
+        base_tree_hash = Commit.unhash(base_commit_hash, self.objects).tree_hash if base_commit_hash else ""
+
+        # only the files either side changed since the base are visited,
+        # identical subtrees being skipped
+        current_changes = self._tree_changes(base_tree_hash, current_commit.tree_hash)
+        incoming_changes = self._tree_changes(base_tree_hash, incoming_commit.tree_hash)
+        # files the current side renamed are merged where it keeps them
+        current_paths = {base_filename: filename for base_filename, filename, base_filehash, _
+                         in current_changes if base_filehash}
+        current_files = {filename: current_filehash for _, filename, _, current_filehash in current_changes}
+
+        entries = self._read_index()
+        incoming_files = {}
+        conflicted_files = {}
+        conflicts = []
+
+        def remove(filename):
+            entries.pop(filename, None)
+            if os.path.exists(self._file(filename)):
+                os.remove(self._file(filename))
+
+        for base_filename, incoming_filename, base_filehash, incoming_filehash in incoming_changes:
+            # a file the incoming side renamed leaves its old name unless the current side changed it
+            if base_filename != incoming_filename and base_filename not in current_paths:
+                remove(base_filename)
+
+            # unchanged on the current side, so the incoming version is taken as is
+            if base_filename not in current_paths and incoming_filename not in current_files:
+                if incoming_filehash:
+                    incoming_files[incoming_filename] = incoming_filehash
+                else:
+                    remove(incoming_filename)
+                continue
+
+            current_filename = current_paths.get(base_filename, incoming_filename)
+            current_filehash = current_files.get(current_filename)
+            # renamed differently on both sides, so the incoming version is left
+            # under its own new name, as the current one is, for one to be chosen
+            if base_filename not in (current_filename, incoming_filename) and incoming_filename != current_filename:
+                conflicts += [current_filename, incoming_filename]
+                if incoming_filename in current_files or incoming_filename in entries:
+                    conflicted_files[add_to_filename(incoming_filename, "_incoming")] = incoming_filehash
+                else:
+                    conflicted_files[incoming_filename] = incoming_filehash
+                continue
+            # a file renamed on the incoming side only is merged under its new name
+            filename = incoming_filename if current_filename == base_filename else current_filename
+            if filename != current_filename and current_filehash:
+                remove(current_filename)
+                incoming_files[filename] = current_filehash
+            if current_filehash == incoming_filehash:
+                continue
+
+            # changed on both sides, so the lines are merged if both still exist
+            merged = self._merge_file(base_filehash, current_filehash, incoming_filehash)
+            if merged is not None:
+                incoming_files.pop(filename, None)
+                with open(self._file(filename), 'wb') as f:
+                    f.write(merged)
+                entries[filename] = (blobify(merged, self.objects), stat_signature(self._file(filename)))
+                continue
+
+            conflicts.append(filename)
+            incoming_files.pop(filename, None)
+            entries.pop(current_filename, None)
+            if current_filehash:
+                filename_current = add_to_filename(filename, "_current")
+                if os.path.exists(self._file(current_filename)):
+                    os.rename(self._file(current_filename), self._file(filename_current))
+                else:
+                    conflicted_files[filename_current] = current_filehash
+            if incoming_filehash:
+                filename_incoming = add_to_filename(filename, "_incoming")
+                conflicted_files[filename_incoming] = incoming_filehash
+
+        self._restore(incoming_files | conflicted_files)
+        for filename, filehash in incoming_files.items():
+            entries[filename] = (filehash, stat_signature(self._file(filename)))
+        self._write_index(entries)
+
+        with open(self.merge_head, 'w') as merge_head:
+            merge_head.write(incoming_commit_hash)
+
+        # a file modified on one side and deleted on the other conflicts as well,
+        # though only one of its versions is left to be resolved
+        if conflicts:
+            return {"up_to_date": False, "commit": None, "conflicts": sorted(conflicts)}
+
+        with open(self.head) as head:
+            current_branch = head.read().split(": ")[1].split("/")[-1]
+        return {"up_to_date": False, "commit": self.commit(f"# Merged {branch} into {current_branch}"),
+                "conflicts": []}
+
+    def _tree_changes(self, from_tree_hash: str, to_tree_hash: str) -> list:
+        """Lists the files that differ between the trees as
+        (from filename, to filename, from filehash or None, to filehash or None),
+        the filenames differing for renamed files"""
+        return [(from_filename, to_filename, from_version[1] if from_version else None,
+                 to_version[1] if to_version else None)
+                for from_filename, to_filename, from_version, to_version in
+                Commit._changes(from_tree_hash, to_tree_hash, self.objects)]
+
+    def _merge_file(self, base_filehash, current_filehash, incoming_filehash):
+        """Merges the lines both sides changed since the base version of the file.
+        Returns the merged data, or None for conflicting changes, deleted or added
+        files and files that are not text"""
+        if not base_filehash or not current_filehash or not incoming_filehash:
+            return None
+        try:
+            base, current, incoming = [unblobify(filehash, self.objects).decode(encoding)
+                                       for filehash in (base_filehash, current_filehash, incoming_filehash)]
+        except UnicodeDecodeError:
+            return None
+
+        merged = merge_lines(base.splitlines(keepends=True), current.splitlines(keepends=True),
+                             incoming.splitlines(keepends=True))
+        return ''.join(merged).encode(encoding) if merged is not None else None
+
+    def log(self, target=None, limit=None, skip=0, since=None, until=None):
+        """Yields (commit hash, Commit) of the history from HEAD or the given
+        branch/tag/commit, newest commits first, made between the since and until
+        timestamps. Commits are read from the graph only as far as they are taken"""
+        start = self.resolve(target) if target else self.head_commit()
+        if skip < 0 or limit is not None and limit < 0:
+            raise GymException("--skip and --limit cannot be negative")
+
+        if start != "none":
+            try:
+                self._graph.get(start)
+            except (FileNotFoundError, ValueError):
+                raise GymException(f"No such commit: {target}")
+
+        commit_hashes = self._log_filter(self._graph.walk(start), since, until)
+        stop = skip + limit if limit is not None else None
+        return ((commit_hash, Commit.unhash(commit_hash, self.objects))
+                for commit_hash in islice(commit_hashes, skip, stop))
+
+    def _log_filter(self, commit_hashes, since, until):
+        """Yields the commits made between since and until. Commits come newest first,
+        so the walk stops at the first one older than since"""
+        for commit_hash in commit_hashes:
+            timestamp = self._graph.get(commit_hash)[2]
+            if since is not None and timestamp < since:
+                return
+            if until is None or timestamp <= until:
+                yield commit_hash
+
+    def errors(self, limit=None):
+        """Yields up to limit records of the error log, newest first"""
+        if limit is not None and limit < 0:
+            raise GymException("--limit cannot be negative")
+        return read_errors(self.log_file, limit)
+
+    def _delta_bases(self) -> dict:
+        """Walks the history back from every ref and maps each version of a file
+        to the version of the same path seen just before it, newer versions coming
+        first, so that the objects nearest to the refs are the ones stored whole"""
+        delta_bases = {}
+        seen_files = set()
+        latest_versions = {}
+
+        seen_commits = set()
+        commit_hashes = self._ref_commit_hashes()
+        while commit_hashes:
+            commit_hash = commit_hashes.pop(0)
+            if commit_hash in seen_commits or commit_hash == "none":
+                continue
+            seen_commits.add(commit_hash)
+
+            tree_hash, parents, _, _ = self._graph.get(commit_hash)
+            for filename, filehash in flatten_tree(tree_hash, self.objects).items():
+                latest_version = latest_versions.get(filename)
+                if filehash not in seen_files and latest_version:
+                    delta_bases[filehash] = latest_version
+                seen_files.add(filehash)
+                latest_versions[filename] = filehash
+            commit_hashes += parents
+
+        return delta_bases
+
+    def repack(self):
+        """Packs all the objects into a single pack file with an index.
+        Returns (pack path, number of objects), the path being None if nothing was packed"""
+        return repack(self.objects, self._delta_bases())
@@ -0,0 +1,159 @@
+import json
+import os
+import socket
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+from GymException import GymException
+
+# A gym server runs the commands of a single repository in one long-lived process,
+# so that they do not pay for starting the interpreter and importing gym, and find
+# the index, the commit graph, the packs and the objects already read. Whatever is
+# kept in memory is checked against the files it was read from before being used.
+# Commands are sent over the socket below as one JSON line, {"args": [...]},
+# and answered with one, {"stdout": "...", "stderr": "...", "status": 0},
+# one at a time. This module only imports what forwarding a command takes
+socket_path = ".gym/server.sock"
+
+
+def _send(connection, message: dict):
+    connection.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive(connection):
+    data = b''
+    while not data.endswith(b'\n'):
+        received = connection.recv(1 << 16)
+        if not received:
+            return None
+        data += received
+    return json.loads(data)
+
+
+def _connect():
+    """Returns a connection to the server of the repository in the current directory,
+    or None if none is running"""
+    if not os.path.exists(socket_path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def _request(connection, message: dict) -> dict:
+    with connection:
+        _send(connection, message)
+        reply = _receive(connection)
+    if reply is None:
+        raise GymException("The gym server closed the connection before answering.")
+    return reply
+
+
+def forward(args):
+    """Runs the command on the server of the repository in the current directory
+    and returns its exit status, or None if no server is running"""
+    if len(args) < 2 or args[1] == "server":
+        return None
+    connection = _connect()
+    if connection is None:
+        return None
+
+    # once sent, the command must not be run again here, so errors are only reported
+    try:
+        reply = _request(connection, {"args": args[1:]})
+    except (OSError, ValueError, GymException) as e:
+        print(f"The gym server failed to run the command: {e}", file=sys.stderr)
+        return 1
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["status"]
+
+
+def _run(run, args) -> dict:
+    """Runs the command as main.py would, capturing what it prints"""
+    stdout, stderr = StringIO(), StringIO()
+    status = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            run(["gym"] + args)
+        except GymException as e:
+            print(e)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+            status = 1
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status}
+
+
+def _is_command(request) -> bool:
+    return isinstance(request, dict) and isinstance(request.get("args"), list) \
+        and all(isinstance(arg, str) for arg in request["args"])
+
+
+def _detach():
+    """Leaves the server running in a child process of its own session"""
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    with open(os.devnull, 'r+') as devnull:
+        for stream in (sys.stdin, sys.stdout, sys.stderr):
+            os.dup2(devnull.fileno(), stream.fileno())
+
+
+def serve(run, detach=False):
+    """Answers the commands sent to the repository in the current directory with
+    run(args) until it is asked to stop"""
+    connection = _connect()
+    if connection is not None:
+        connection.close()
+        raise GymException("A gym server is already running for this repository.")
+    # a socket left behind by a server that did not stop cleanly
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        print(f"Serving the repository at {socket_path}")
+        # clients connecting from now on wait for the server in the backlog
+        if detach:
+            sys.stdout.flush()
+            _detach()
+
+        try:
+            while True:
+                connection, _ = server.accept()
+                with connection:
+                    try:
+                        request = _receive(connection)
+                    except (OSError, ValueError):
+                        continue
+                    if request is None:
+                        continue
+                    if isinstance(request, dict) and request.get("stop"):
+                        _send(connection, {"stdout": "", "stderr": "", "status": 0})
+                        return
+                    try:
+                        _send(connection, _run(run, request["args"]) if _is_command(request) else
+                              {"stdout": "", "stderr": "Not a gym command request.\n", "status": 1})
+                    except OSError:
+                        # the client went away
+                        pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+def stop():
+    """Stops the server of the repository in the current directory"""
+    connection = _connect()
+    if connection is None:
+        raise GymException("No gym server is running for this repository.")
+    _request(connection, {"stop": True})
+    print("Stopped the gym server")
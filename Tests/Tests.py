@@ -2,14 +2,38 @@ import argparse
 import os
 import sys
 import unittest
+from unittest import mock
 import shutil
+import tempfile
+import time
+import random
+from hashlib import sha1
 
-from io import StringIO
+from contextlib import redirect_stdout
+from io import StringIO, BytesIO
 
 from Commit import Commit
+from CommitGraph import CommitGraph
 from GymException import GymException
 from GymRepository import GymRepository
-from Files import blobify, encoding, add_to_filename
+from Repository import Repository
+from Index import Index, write_index, update_index
+from Merge import merge_lines
+from Diff import line_opcodes, unified_hunks, diff_lines, stat_lines, detect_renames
+from difflib import unified_diff
+import Files
+import Chunker
+from Chunker import read_chunks
+from Delta import make_delta, apply_delta
+from ObjectCache import ObjectCache
+from Files import blobify, unblobify, blobify_file, unblobify_to_file, \
+    object_exists, repack, read_tree, flatten_tree, diff_trees, encoding, add_to_filename, stat_signature, \
+    chunk_list, object_cache, match_files, scan_files, walk_files
+from Ignore import IgnoreRules
+import ErrorLog
+from ErrorLog import log_error, read_errors
+import Server
+import threading
 
 
 class InitTests(unittest.TestCase):
@@ -57,6 +81,27 @@ class AddTests(unittest.TestCase):
         with self.assertRaises(GymException):
             GymRepository.add(args)
 
+    def test_add_with_no_jobs(self):
+        with self.assertRaises(GymException):
+            GymRepository.add([self.file_path], jobs=0)
+
+    def test_add_directory(self):
+        directory = "add_directory"
+        files = [os.path.join(directory, name) for name in ("a.txt", "a.txt2", "b.txt")]
+        os.makedirs(directory, exist_ok=True)
+        for file in files:
+            with open(file, 'w') as f:
+                f.write(file)
+
+        GymRepository.add([directory], jobs=2)
+        GymRepository.add([files[0]])
+        index = GymRepository._read_index()
+        shutil.rmtree(directory)
+        open(GymRepository.index, 'w').close()
+
+        for file in files:
+            self.assertIn(file, index)
+
 
 class CommitTests(unittest.TestCase):
     """Tests for command commit"""
@@ -239,6 +284,18 @@ class CheckoutTests(unittest.TestCase):
         assert not os.path.exists(self.boss_file)
         assert os.path.exists(self.other_file)
 
+    def test_checkout_keeps_unchanged_files(self):
+        unchanged_file = "initial.txt"
+        os.utime(unchanged_file, ns=(10 ** 9, 10 ** 9))
+
+        args = argparse.Namespace()
+        args.target = self.tag
+        GymRepository.checkout(args)
+
+        self.assertEqual(os.stat(unchanged_file).st_mtime_ns, 10 ** 9)
+        self.assertFalse(os.path.exists(self.boss_file))
+        self.assertEqual(GymRepository._read_index().keys(), {unchanged_file})
+
 
 class MergeTests(unittest.TestCase):
 
@@ -314,5 +371,1161 @@ class MergeTests(unittest.TestCase):
         assert os.path.exists(add_to_filename(self.other_file, "_incoming"))
 
 
+class CommitFormatTests(unittest.TestCase):
+    """Tests for storing and parsing commit objects"""
+
+    def test_commit_roundtrip(self):
+        commit = Commit("Several\nlines\n\nmessage: not a header", "a" * 40, ["b" * 40, "c" * 40], 1700000000, "author")
+        self.assertEqual(Commit.serialize(commit.encode()),
+                         (commit.message, "a" * 40, ["b" * 40, "c" * 40], 1700000000, "author"))
+
+    def test_first_commit_has_no_parents(self):
+        commit = Commit("First", "a" * 40, ["none"], 1700000000, "author")
+        self.assertNotIn(b"parent", commit.encode())
+        self.assertEqual(Commit.serialize(commit.encode())[2], ["none"])
+
+    def test_text_commit_is_parsed_without_eval(self):
+        text_commit = f"message: Old\ntree: {'a' * 40}\nprevious commits: ['{'b' * 40}']\ntimestamp: 5"
+        self.assertEqual(Commit.serialize(text_commit.encode(encoding)), ("Old", "a" * 40, ["b" * 40], 5, ""))
+
+        evil_commit = "message: Old\ntree: tree\nprevious commits: __import__('os').getcwd()"
+        self.assertEqual(Commit.serialize(evil_commit.encode(encoding))[2], [])
+
+    def test_malformed_commit(self):
+        commit = Commit("Message", "a" * 40, ["none"], 1700000000, "author").encode()
+        self.assertIsNone(Commit.serialize(commit + b"more"))
+        self.assertIsNone(Commit.serialize(commit.replace(b"author", b"writer")))
+        self.assertIsNone(Commit.serialize(b"tree " + b"a" * 40))
+
+
+class DiffTests(unittest.TestCase):
+    """Tests for the line diff and the diff output"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_line_opcodes(self):
+        a = list("abcabba")
+        b = list("cbabac")
+        opcodes = line_opcodes(a, b)
+        self.assertEqual(sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal"), 4)
+        merged = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            merged += b[j1:j2] if tag != "equal" else a[i1:i2]
+        self.assertEqual(merged, b)
+
+    def test_line_opcodes_of_costly_diffs(self):
+        lines = [f"{i}\n" for i in range(3000)]
+        shuffled = lines[:]
+        random.Random(1).shuffle(shuffled)
+        cases = [(lines, lines[::-1]), (lines, shuffled),
+                 (["a\n", "b\n"] * 2500, ["b\n", "a\n", "a\n"] * 1666)]
+
+        start = time.monotonic()
+        for a, b in cases:
+            merged = []
+            for tag, i1, i2, j1, j2 in line_opcodes(a, b):
+                if tag == "equal":
+                    self.assertEqual(a[i1:i2], b[j1:j2])
+                merged += b[j1:j2]
+            self.assertEqual(merged, b)
+        # a minimal diff of these takes tens of seconds
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_unified_hunks_match_difflib(self):
+        a = [str(i) for i in range(100)]
+        b = a[:10] + ["changed"] + a[11:50] + ["inserted"] + a[50:80] + a[81:]
+        self.assertEqual(list(unified_hunks(a, b)), list(unified_diff(a, b, lineterm=""))[2:])
+        self.assertEqual(list(unified_hunks(a, a)), [])
+
+    def test_binary_and_large_files(self):
+        text = blobify(b"line\n", self.directory)
+        binary = blobify(b"\x00\x01", self.directory)
+        large = blobify(b"line\n" * 100, self.directory)
+
+        self.assertEqual(list(diff_lines([("a.bin", "a.bin", ("blob", text), ("blob", binary))], self.directory)),
+                         ["diff a.bin", "Binary files differ"])
+        self.assertEqual(list(diff_lines([("a.txt", "a.txt", ("blob", text), ("blob", large))], self.directory, 100)),
+                         ["diff a.txt", "File too large to compare (500 bytes)"])
+        self.assertEqual(list(stat_lines([("a.txt", "a.txt", None, ("blob", large))], self.directory)),
+                         ["Added: a.txt (500 bytes)"])
+
+
+class RenameTests(unittest.TestCase):
+    """Tests for pairing deleted files with the added ones they were renamed to"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.text = "".join(f"line {i}\n" for i in range(20)).encode(encoding)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _blob(self, data):
+        return "blob", blobify(data, self.directory)
+
+    def test_exact_rename(self):
+        changes = [("a.txt", self._blob(self.text), None), ("b.txt", None, self._blob(self.text))]
+        self.assertEqual(detect_renames(changes, self.directory),
+                         [("a.txt", "b.txt", self._blob(self.text), self._blob(self.text))])
+
+    def test_similar_rename(self):
+        changed_text = self.text.replace(b"line 3\n", b"changed\n")
+        changes = [("a.txt", self._blob(self.text), None), ("b.txt", None, self._blob(changed_text)),
+                   ("c.txt", None, self._blob(b"unrelated\n" * 20))]
+        renamed = detect_renames(changes, self.directory)
+        self.assertIn(("a.txt", "b.txt", self._blob(self.text), self._blob(changed_text)), renamed)
+        self.assertIn(("c.txt", "c.txt", None, self._blob(b"unrelated\n" * 20)), renamed)
+
+        self.assertEqual(len(detect_renames(changes, self.directory, threshold=100)), 3)
+        self.assertEqual(len(detect_renames(changes, self.directory, max_pairs=1)), 3)
+
+
+class TreeTests(unittest.TestCase):
+    """Tests for the tree objects of commits"""
+
+    def setUp(self):
+        self.directory = "tree_directory"
+        self.changed_file = os.path.join(self.directory, "a", "x.txt")
+        self.unchanged_file = os.path.join(self.directory, "b", "y.txt")
+        for file in (self.changed_file, self.unchanged_file):
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, 'w') as f:
+                f.write(file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        with open(GymRepository.head, 'w') as head:
+            head.write("hash: none")
+        open(GymRepository.index, 'w').close()
+
+    def _commit(self, message):
+        GymRepository.add([self.directory])
+        args = argparse.Namespace()
+        args.message = message
+        GymRepository.commit(args)
+        return GymRepository._get_current_commit_hash()
+
+    def _subtree(self, tree_hash, path):
+        for name in path.split('/'):
+            tree_hash = read_tree(tree_hash, GymRepository.objects)[name][1]
+        return tree_hash
+
+    def test_unchanged_subtrees_are_shared(self):
+        first_tree = Commit.unhash(self._commit("First tree")).tree_hash
+        with open(self.changed_file, 'a') as f:
+            f.write(" changed")
+        second_tree = Commit.unhash(self._commit("Second tree")).tree_hash
+
+        unchanged_directory = f"{self.directory}/b"
+        self.assertEqual(self._subtree(first_tree, unchanged_directory),
+                         self._subtree(second_tree, unchanged_directory))
+        self.assertEqual([change[0] for change in
+                          diff_trees(first_tree, second_tree, GymRepository.objects)],
+                         [self.changed_file])
+        self.assertEqual(set(flatten_tree(second_tree, GymRepository.objects)),
+                         {self.changed_file, self.unchanged_file})
+
+
+class CommitGraphTests(unittest.TestCase):
+    """Tests for the commit-graph file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "commit-graph")
+        tree_hash = blobify("".encode(encoding), GymRepository.objects)
+
+        self.commits = {}
+        for name, parents in (("a", ["none"]), ("b", ["a"]), ("c", ["a"]), ("d", ["b", "c"])):
+            commit = Commit(f"Graph commit {name}", tree_hash,
+                            [self.commits.get(parent, parent) for parent in parents])
+            self.commits[name] = commit.blobify()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_graph_backfills_ancestors(self):
+        graph = CommitGraph(self.path)
+        self.assertEqual(graph.generation(self.commits["d"]), 3)
+        self.assertEqual(graph.parents(self.commits["d"]), (self.commits["b"], self.commits["c"]))
+
+        reread_graph = CommitGraph(self.path)
+        self.assertIn(self.commits["a"], reread_graph)
+        self.assertEqual(reread_graph.get(self.commits["a"])[1:], ((), graph.get(self.commits["a"])[2], 1))
+
+    def test_adding_reads_only_the_end(self):
+        CommitGraph(self.path).get(self.commits["d"])
+        commit = Commit("Graph commit e", Commit.unhash(self.commits["d"]).tree_hash, [self.commits["d"]])
+        commit_hash = commit.blobify()
+
+        with mock.patch("CommitGraph._scan_records", 1):
+            graph = CommitGraph(self.path)
+            graph.add(commit_hash, commit)
+            graph.add(commit_hash, commit)
+            self.assertNotIn(self.commits["a"], graph._commits)
+        self.assertEqual(os.path.getsize(self.path), 4 + 4 + 5 * (4 * 20 + 8 + 4))
+        self.assertEqual(CommitGraph(self.path).generation(commit_hash), 4)
+
+    def test_ancestry_queries(self):
+        graph = CommitGraph(self.path)
+        self.assertEqual(graph.merge_base(self.commits["b"], self.commits["c"]), self.commits["a"])
+        self.assertEqual(graph.merge_base(self.commits["d"], self.commits["c"]), self.commits["c"])
+        self.assertEqual(graph.merge_base(self.commits["c"], self.commits["d"]), self.commits["c"])
+        self.assertTrue(graph.is_ancestor(self.commits["a"], self.commits["d"]))
+        self.assertFalse(graph.is_ancestor(self.commits["b"], self.commits["c"]))
+
+    def _repository(self):
+        os.mkdir(os.path.join(self.directory, "repository"))
+        repository = Repository.init(os.path.join(self.directory, "repository"))
+        with open(os.path.join(repository.path, "a.txt"), 'w') as f:
+            f.write("a")
+        repository.add("a.txt")
+        return repository, repository.commit("Root")["commit"]
+
+    def test_graph_backfills_single_root(self):
+        repository, root = self._repository()
+        # a repository made before the graph existed
+        os.remove(repository.commit_graph)
+
+        repository = Repository(repository.path)
+        self.assertEqual([commit_hash for commit_hash, _ in repository.log()], [root])
+        self.assertEqual(repository._graph.merge_base(root, root), root)
+        self.assertEqual(CommitGraph(repository.commit_graph).generation(root), 1)
+
+    def test_graph_drops_torn_record(self):
+        repository, root = self._repository()
+        # an append interrupted part of the way
+        with open(repository.commit_graph, 'ab') as f:
+            f.write(b"torn")
+
+        with open(os.path.join(repository.path, "a.txt"), 'w') as f:
+            f.write("b")
+        repository.add("a.txt")
+        second = repository.commit("Second")["commit"]
+        self.assertEqual([commit_hash for commit_hash, _ in Repository(repository.path).log()], [second, root])
+        self.assertEqual(os.path.getsize(repository.commit_graph), 4 + 4 + 2 * (4 * 20 + 8 + 4))
+
+
+class LogTests(unittest.TestCase):
+    """Tests for command log"""
+
+    def setUp(self):
+        self.file_path = "log.txt"
+        args = argparse.Namespace()
+        for i in range(3):
+            with open(self.file_path, 'w') as file:
+                file.write(f"Log file {i}")
+            GymRepository.add([self.file_path])
+            args.message = f"Log commit {i}"
+            GymRepository.commit(args)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        with open(GymRepository.head, 'w') as head:
+            head.write("hash: none")
+        open(GymRepository.index, 'w').close()
+
+    def _log(self, **options):
+        args = argparse.Namespace(target=None, limit=None, skip=0, since=None, until=None)
+        vars(args).update(options)
+        output = StringIO()
+        with redirect_stdout(output):
+            GymRepository.log(args)
+        return [line.strip() for line in output.getvalue().split('\n') if "Log commit" in line]
+
+    def test_log_newest_first(self):
+        self.assertEqual(self._log()[:3], ["Log commit 2", "Log commit 1", "Log commit 0"])
+
+    def test_log_paging(self):
+        self.assertEqual(self._log(skip=1, limit=1), ["Log commit 1"])
+
+    def test_log_since(self):
+        self.assertEqual(self._log(since="2999-01-01"), [])
+        with self.assertRaises(GymException):
+            self._log(since="yesterday")
+
+
+class ThreeWayMergeTests(unittest.TestCase):
+    """Tests for merging against the common ancestor"""
+
+    def setUp(self):
+        self.output = StringIO()
+        self.file_path = "threeway.txt"
+        self.new_file = "threeway_new.txt"
+        self.branch = "threeway"
+        self.incoming_branch = "threeway-incoming"
+
+        with open(GymRepository.head, 'w') as head:
+            head.write(f"ref: {GymRepository.get_ref(self.branch, reftype='branch')}")
+        GymRepository._create_ref(f"branch/{self.branch}", "none")
+        open(GymRepository.index, 'w').close()
+
+        self._commit("1\n2\n3\n4\n5\n", "Base")
+        args = argparse.Namespace()
+        args.name = self.incoming_branch
+        GymRepository.branch(args)
+
+    def tearDown(self):
+        for file in (self.file_path, self.new_file,
+                     add_to_filename(self.file_path, "_current"), add_to_filename(self.file_path, "_incoming")):
+            if os.path.exists(file):
+                os.remove(file)
+        with open(GymRepository.head, 'w') as head:
+            head.write("hash: none")
+        open(GymRepository.index, 'w').close()
+
+    def _commit(self, content, message):
+        with open(self.file_path, 'w') as file:
+            file.write(content)
+        args = argparse.Namespace()
+        args.message = message
+        with redirect_stdout(self.output):
+            GymRepository.add([self.file_path])
+            GymRepository.commit(args)
+
+    def _checkout(self, branch):
+        args = argparse.Namespace()
+        args.target = branch
+        with redirect_stdout(self.output):
+            GymRepository.checkout(args)
+
+    def _merge(self):
+        args = argparse.Namespace()
+        args.branch = self.incoming_branch
+        with redirect_stdout(self.output):
+            GymRepository.merge(args)
+
+    def test_merge_changes_of_both_sides(self):
+        self._commit("one\n2\n3\n4\n5\n", "Current change")
+        current_commit_hash = GymRepository._get_current_commit_hash()
+
+        self._checkout(self.incoming_branch)
+        with open(self.new_file, 'w') as file:
+            file.write("New file")
+        GymRepository.add([self.new_file])
+        self._commit("1\n2\n3\n4\nfive\n", "Incoming change")
+        incoming_commit_hash = GymRepository._get_current_commit_hash()
+
+        self._checkout(self.branch)
+        self.assertFalse(os.path.exists(self.new_file))
+        self._merge()
+
+        merge_commit = Commit.unhash(GymRepository._get_current_commit_hash())
+        self.assertTrue(merge_commit.message.startswith("# Merged"))
+        self.assertEqual(merge_commit.pchs, [current_commit_hash, incoming_commit_hash])
+        with open(self.file_path, 'r') as file:
+            self.assertEqual(file.read(), "one\n2\n3\n4\nfive\n")
+        self.assertTrue(os.path.exists(self.new_file))
+
+    def test_merge_conflicting_lines(self):
+        self._commit("1\n2\nthree\n4\n5\n", "Current change")
+        self._checkout(self.incoming_branch)
+        self._commit("1\n2\nTHREE\n4\n5\n", "Incoming change")
+        self._checkout(self.branch)
+        self._merge()
+
+        self.assertTrue(os.path.exists(add_to_filename(self.file_path, "_current")))
+        self.assertTrue(os.path.exists(add_to_filename(self.file_path, "_incoming")))
+        self.assertTrue(os.path.exists(GymRepository.merge_head))
+
+        with open(self.file_path, 'w') as file:
+            file.write("1\n2\n3\n4\n5\nresolved\n")
+        args = argparse.Namespace()
+        args.message = "Resolved"
+        with redirect_stdout(self.output):
+            GymRepository.add([self.file_path])
+            GymRepository.commit(args)
+        self.assertEqual(len(Commit.unhash(GymRepository._get_current_commit_hash()).pchs), 2)
+        self.assertFalse(os.path.exists(GymRepository.merge_head))
+
+    def _delete(self, message):
+        os.remove(self.file_path)
+        args = argparse.Namespace()
+        args.message = message
+        with redirect_stdout(self.output):
+            GymRepository.commit(args)
+
+    def test_merge_modified_and_deleted(self):
+        self._commit("one\n2\n3\n4\n5\n", "Current change")
+        current_commit_hash = GymRepository._get_current_commit_hash()
+        self._checkout(self.incoming_branch)
+        self._delete("Incoming deletion")
+        self._checkout(self.branch)
+        self._merge()
+
+        self.assertEqual(GymRepository._get_current_commit_hash(), current_commit_hash)
+        self.assertTrue(os.path.exists(GymRepository.merge_head))
+        with open(add_to_filename(self.file_path, "_current"), 'r') as file:
+            self.assertEqual(file.read(), "one\n2\n3\n4\n5\n")
+
+    def test_merge_deleted_and_modified(self):
+        self._delete("Current deletion")
+        current_commit_hash = GymRepository._get_current_commit_hash()
+        self._checkout(self.incoming_branch)
+        self._commit("1\n2\n3\n4\nfive\n", "Incoming change")
+        self._checkout(self.branch)
+        self._merge()
+
+        self.assertEqual(GymRepository._get_current_commit_hash(), current_commit_hash)
+        self.assertTrue(os.path.exists(GymRepository.merge_head))
+        with open(add_to_filename(self.file_path, "_incoming"), 'r') as file:
+            self.assertEqual(file.read(), "1\n2\n3\n4\nfive\n")
+
+    def test_merge_keeps_changes_not_added(self):
+        self._checkout(self.incoming_branch)
+        self._commit("1\n2\n3\n4\nfive\n", "Incoming change")
+        self._checkout(self.branch)
+        with open(self.file_path, 'w') as file:
+            file.write("not added\n")
+
+        with self.assertRaises(GymException):
+            self._merge()
+        with open(self.file_path, 'r') as file:
+            self.assertEqual(file.read(), "not added\n")
+        self.assertFalse(os.path.exists(GymRepository.merge_head))
+
+    def test_merge_follows_renamed_file(self):
+        self._commit("one\n2\n3\n4\n5\n", "Current change")
+
+        self._checkout(self.incoming_branch)
+        os.rename(self.file_path, self.new_file)
+        with open(self.new_file, 'w') as file:
+            file.write("1\n2\n3\n4\nfive\n")
+        args = argparse.Namespace()
+        args.message = "Incoming rename"
+        with redirect_stdout(self.output):
+            GymRepository.add([self.new_file])
+            GymRepository.commit(args)
+
+        self._checkout(self.branch)
+        self._merge()
+
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertFalse(os.path.exists(add_to_filename(self.new_file, "_current")))
+        with open(self.new_file, 'r') as file:
+            self.assertEqual(file.read(), "one\n2\n3\n4\nfive\n")
+        self.assertEqual(set(Commit.unhash(GymRepository._get_current_commit_hash()).files) &
+                         {self.file_path, self.new_file}, {self.new_file})
+
+    def _rename(self, filename, message):
+        os.rename(self.file_path, filename)
+        args = argparse.Namespace()
+        args.message = message
+        with redirect_stdout(self.output):
+            GymRepository.add([filename])
+            GymRepository.commit(args)
+
+    def test_merge_renamed_differently(self):
+        current_name = "threeway_renamed.txt"
+        self.addCleanup(lambda: os.path.exists(current_name) and os.remove(current_name))
+        self._rename(current_name, "Current rename")
+        current_commit_hash = GymRepository._get_current_commit_hash()
+        self._checkout(self.incoming_branch)
+        self._rename(self.new_file, "Incoming rename")
+        self._checkout(self.branch)
+
+        result = GymRepository._repository().merge(self.incoming_branch)
+
+        self.assertEqual(result["conflicts"], sorted([current_name, self.new_file]))
+        self.assertEqual(GymRepository._get_current_commit_hash(), current_commit_hash)
+        self.assertFalse(os.path.exists(self.file_path))
+        for filename in (current_name, self.new_file):
+            with open(filename, 'r') as file:
+                self.assertEqual(file.read(), "1\n2\n3\n4\n5\n")
+
+    def test_merge_lines(self):
+        base = ["a\n", "b\n", "c\n"]
+        self.assertEqual(merge_lines(base, ["A\n", "b\n", "c\n"], ["a\n", "b\n", "c\n", "d\n"]),
+                         ["A\n", "b\n", "c\n", "d\n"])
+        self.assertIsNone(merge_lines(base, ["a\n", "B\n", "c\n"], ["a\n", "b2\n", "c\n"]))
+
+
+class StatusTests(unittest.TestCase):
+    """Tests for gym status"""
+
+    def setUp(self):
+        self.output = StringIO()
+        self.directory = "status_dir"
+        self.committed_file = "status_dir/committed.txt"
+        self.staged_file = "status_dir/staged.txt"
+        self.untracked_file = "status_dir/untracked.txt"
+
+        with open(GymRepository.head, 'w') as head:
+            head.write("hash: none")
+        open(GymRepository.index, 'w').close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.committed_file, 'w') as file:
+            file.write("Committed")
+        args = argparse.Namespace()
+        args.message = "Status"
+        with redirect_stdout(self.output):
+            GymRepository.add([self.committed_file])
+            GymRepository.commit(args)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with open(GymRepository.head, 'w') as head:
+            head.write("hash: none")
+        open(GymRepository.index, 'w').close()
+
+    def _status(self):
+        status = GymRepository._status()
+        # the files of the other tests are of no interest here
+        return {key: [file for file in files if self.directory in str(file)]
+                for key, files in status.items()}
+
+    def test_status_clean(self):
+        self.assertEqual(self._status(), {"staged": [], "modified": [], "deleted": [], "untracked": []})
+
+    def test_status_changes(self):
+        with open(self.staged_file, 'w') as file:
+            file.write("Staged")
+        with redirect_stdout(self.output):
+            GymRepository.add([self.staged_file])
+        with open(self.untracked_file, 'w') as file:
+            file.write("Untracked")
+        with open(self.committed_file, 'w') as file:
+            file.write("Modified")
+
+        status = self._status()
+        self.assertEqual(status["staged"], [("Added", self.staged_file)])
+        self.assertEqual(status["modified"], [self.committed_file])
+        self.assertEqual(status["untracked"], [self.untracked_file])
+
+        os.remove(self.staged_file)
+        self.assertEqual(self._status()["deleted"], [self.staged_file])
+
+    def test_status_rewritten_with_same_content(self):
+        with open(self.committed_file, 'w') as file:
+            file.write("Committed")
+        self.assertEqual(self._status()["modified"], [])
+
+
+class IgnoreTests(unittest.TestCase):
+    """Tests for the .gymignore files"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._write(".gymignore", "# comment\n*.pyc\n!keep.pyc\nbuild/\n/top.txt\ndocs/**/*.tmp\n")
+        self._write("sub/.gymignore", "!*.pyc\nlocal.txt\n")
+        self.rules = IgnoreRules(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, path, content=""):
+        path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_patterns(self):
+        self.assertTrue(self.rules.ignored("a.pyc"))
+        self.assertTrue(self.rules.ignored("deep/er/a.pyc"))
+        self.assertFalse(self.rules.ignored("keep.pyc"))
+        self.assertTrue(self.rules.ignored("build", is_directory=True))
+        self.assertFalse(self.rules.ignored("build"))
+        self.assertTrue(self.rules.ignored("top.txt"))
+        self.assertFalse(self.rules.ignored("other/top.txt"))
+        self.assertTrue(self.rules.ignored("docs/a/b/c.tmp"))
+        self.assertTrue(self.rules.ignored("docs/c.tmp"))
+        self.assertFalse(self.rules.ignored("a.py"))
+
+    def test_deeper_file_decides_first(self):
+        self.assertFalse(self.rules.ignored("sub/a.pyc"))
+        self.assertTrue(self.rules.ignored("sub/local.txt"))
+        self.assertFalse(self.rules.ignored("local.txt"))
+
+    def test_walk_skips_ignored_directories(self):
+        for path in ("a.py", "a.pyc", "build/out.txt", "sub/a.pyc", "sub/build/out.txt"):
+            self._write(path)
+        expected = {".gymignore", "a.py", "sub/.gymignore", "sub/a.pyc"}
+
+        matched = match_files(self.directory, self.rules)
+        self.assertEqual({os.path.relpath(path, self.directory).replace(os.sep, '/') for path in matched}, expected)
+        self.assertEqual(set(scan_files(self.directory, ignore=self.rules)), expected)
+
+
+class WalkTests(unittest.TestCase):
+    """Tests for walking the working directory"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        for path in ("a.txt", "dir/b.txt", "dir/deeper/c.txt", ".gym/objects/d"):
+            os.makedirs(os.path.join(self.directory, os.path.dirname(path)), exist_ok=True)
+            open(os.path.join(self.directory, path), 'w').close()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_walk_files(self):
+        walked = dict(walk_files("."))
+        self.assertEqual(set(walked), {"a.txt", os.path.join("dir", "b.txt"), os.path.join("dir", "deeper", "c.txt")})
+        self.assertEqual(walked["a.txt"], stat_signature("a.txt"))
+        self.assertEqual([path for path, _ in walk_files("dir/b.txt")], ["dir/b.txt"])
+        self.assertEqual(list(walk_files("missing")), [])
+
+    def test_walk_is_lazy(self):
+        walk = walk_files(".")
+        self.assertIsInstance(next(walk), tuple)
+        walk.close()
+
+
+class ErrorLogTests(unittest.TestCase):
+    """Tests for the error log"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "error.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def log(self, message, **kwargs):
+        try:
+            raise ValueError(message)
+        except ValueError:
+            log_error(self.path, *sys.exc_info(), **kwargs)
+
+    def test_newest_first(self):
+        for i in range(1000):
+            self.log(f"error {i}")
+        records = list(read_errors(self.path, 3))
+        self.assertEqual([record["message"] for record in records], ["error 999", "error 998", "error 997"])
+        self.assertEqual(records[0]["type"], "ValueError")
+        self.assertIn("raise ValueError(message)", records[0]["traceback"])
+        self.assertEqual(len(list(read_errors(self.path))), 1000)
+
+    def test_rotation(self):
+        for i in range(50):
+            self.log(f"error {i}", max_size=4096, backups=2)
+        self.assertTrue(os.path.exists(self.path + ".2"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        for path in (self.path, self.path + ".1", self.path + ".2"):
+            self.assertLessEqual(os.path.getsize(path), 4096)
+
+        messages = [record["message"] for record in read_errors(self.path, backups=2)]
+        self.assertEqual(messages[0], "error 49")
+        self.assertEqual(messages, [f"error {i}" for i in range(49, 49 - len(messages), -1)])
+
+    def test_text_log(self):
+        with open(self.path, 'w') as f:
+            f.write("[2024-01-01 12:00:00]\n\nTraceback (most recent call last):\n" + '-' * 30 + '\n')
+        self.log("error")
+        self.assertEqual([record["message"] for record in read_errors(self.path)], ["error"])
+        self.assertEqual(list(read_errors(os.path.join(self.directory, "missing.log"))), [])
+
+
+class ServerTests(unittest.TestCase):
+    """Tests for forwarding commands to a gym server"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir(".gym")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def run_command(args):
+        if args[1] == "fail":
+            raise GymException("failed")
+        if args[1] == "exit":
+            sys.exit(2)
+        print(' '.join(args[1:]))
+
+    def test_forward(self):
+        self.assertIsNone(Server.forward(["gym", "status"]))
+
+        with redirect_stdout(StringIO()):
+            server = threading.Thread(target=Server.serve, args=(self.run_command,))
+            server.start()
+            while not os.path.exists(Server.socket_path):
+                time.sleep(0.01)
+
+        output = StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(Server.forward(["gym", "add", "a.txt"]), 0)
+            self.assertEqual(Server.forward(["gym", "fail"]), 0)
+            self.assertEqual(Server.forward(["gym", "exit"]), 2)
+            self.assertIsNone(Server.forward(["gym", "server", "--stop"]))
+            with self.assertRaises(GymException):
+                Server.serve(self.run_command)
+            Server.stop()
+        server.join()
+
+        self.assertEqual(output.getvalue(), "add a.txt\nfailed\nStopped the gym server\n")
+        self.assertFalse(os.path.exists(Server.socket_path))
+        self.assertIsNone(Server.forward(["gym", "status"]))
+
+    def test_malformed_requests(self):
+        with redirect_stdout(StringIO()):
+            server = threading.Thread(target=Server.serve, args=(self.run_command,))
+            server.start()
+            while not os.path.exists(Server.socket_path):
+                time.sleep(0.01)
+
+        for request in ([], "x", {}, {"args": "status"}, {"args": [1]}):
+            reply = Server._request(Server._connect(), request)
+            self.assertEqual(reply["status"], 1)
+            self.assertEqual(reply["stdout"], "")
+
+        output = StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(Server.forward(["gym", "add", "a.txt"]), 0)
+            Server.stop()
+        server.join()
+        self.assertEqual(output.getvalue(), "add a.txt\nStopped the gym server\n")
+
+
+class RepositoryTests(unittest.TestCase):
+    """Tests for working on repositories by their paths"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directories = [tempfile.mkdtemp() for _ in range(2)]
+
+    def tearDown(self):
+        self.assertEqual(os.getcwd(), self.cwd)
+        for directory in self.directories:
+            shutil.rmtree(directory)
+
+    def write(self, directory, filename, content):
+        os.makedirs(os.path.join(directory, os.path.dirname(filename)), exist_ok=True)
+        with open(os.path.join(directory, filename), 'w') as f:
+            f.write(content)
+
+    def test_two_repositories(self):
+        first, second = [Repository.init(directory) for directory in self.directories]
+        self.write(self.directories[0], "dir/a.txt", "first")
+        self.write(self.directories[1], "b.txt", "second")
+
+        self.assertEqual(first.add("dir"), [(os.path.join("dir", "a.txt"), sha1(b"first").hexdigest())])
+        self.assertEqual([filename for filename, _ in second.add(".")], ["b.txt"])
+
+        result = first.commit("First")
+        self.assertEqual(result["parents"], ["none"])
+        self.assertEqual(first.head_commit(), result["commit"])
+        self.assertEqual(second.head_commit(), "none")
+        commit = Commit.unhash(result["commit"], first.objects)
+        self.assertEqual(commit.files, {"dir/a.txt": sha1(b"first").hexdigest()})
+
+        self.write(self.directories[0], "dir/a.txt", "changed")
+        self.write(self.directories[0], "new.txt", "new")
+        status = first.status()
+        self.assertEqual(status["modified"], [os.path.join("dir", "a.txt")])
+        self.assertEqual(status["untracked"], ["new.txt"])
+        self.assertEqual(second.status()["staged"], [("Added", "b.txt")])
+
+        self.assertEqual(list(first.diff(stat=True)), ["Changed: dir/a.txt (5 -> 7 bytes)"])
+        self.assertEqual([(commit_hash, commit.message) for commit_hash, commit in first.log()],
+                         [(result["commit"], "First")])
+
+    def test_branches(self):
+        repository = Repository.init(self.directories[0])
+        self.write(self.directories[0], "a.txt", "one")
+        repository.add("a.txt")
+        first = repository.commit("First")["commit"]
+        self.assertEqual(repository.branch("side"), first)
+
+        self.write(self.directories[0], "a.txt", "two")
+        repository.add("a.txt")
+        second = repository.commit("Second")
+        self.assertEqual(second["changes"], [("a.txt", "a.txt", ("blob", sha1(b"one").hexdigest()),
+                                              ("blob", sha1(b"two").hexdigest()))])
+
+        self.assertEqual(repository.checkout("side"), {"commit": first, "detached": False})
+        with open(os.path.join(self.directories[0], "a.txt")) as f:
+            self.assertEqual(f.read(), "one")
+        merge = repository.merge("boss")
+        self.assertEqual(merge["conflicts"], [])
+        self.assertEqual(merge["commit"]["parents"], [first, second["commit"]])
+        with open(os.path.join(self.directories[0], "a.txt")) as f:
+            self.assertEqual(f.read(), "two")
+
+    def test_commit_reads_no_files_for_renames(self):
+        directory = self.directories[0]
+        repository = Repository.init(directory)
+        self.write(directory, "a.txt", "moved\n")
+        self.write(directory, "b.txt", "edited\n" * 10)
+        repository.add(".")
+        first = repository.commit("First")["commit"]
+
+        os.rename(os.path.join(directory, "a.txt"), os.path.join(directory, "c.txt"))
+        os.remove(os.path.join(directory, "b.txt"))
+        self.write(directory, "d.txt", "edited\n" * 10 + "more\n")
+        repository.add(".")
+        with mock.patch("Diff._read", side_effect=AssertionError("a file was read")):
+            result = repository.commit("Second")
+        # only the file moved unchanged is listed as renamed
+        self.assertEqual([(old, new) for old, new, _, _ in result["changes"]],
+                         [("a.txt", "c.txt"), ("b.txt", "b.txt"), ("d.txt", "d.txt")])
+        # which diff still pairs by similarity
+        self.assertEqual([(old, new) for old, new, _, _ in repository.changes([first, result["commit"]])],
+                         [("a.txt", "c.txt"), ("b.txt", "d.txt")])
+
+    def test_not_a_repository(self):
+        with self.assertRaises(GymException):
+            Repository(self.directories[0])
+        Repository.init(self.directories[0])
+        with self.assertRaises(GymException):
+            Repository.init(self.directories[0])
+
+
+class RestoreTests(unittest.TestCase):
+    """Tests for writing files from the objects to the working directory"""
+
+    def setUp(self):
+        self.directory = "restore_directory"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_restore_files(self):
+        files = {os.path.join(self.directory, str(i % 3), f"{i}.txt"):
+                 blobify(str(i).encode(encoding), GymRepository.objects) for i in range(20)}
+        GymRepository._restore(files)
+        for i, filename in enumerate(files):
+            with open(filename, 'r') as f:
+                self.assertEqual(f.read(), str(i))
+
+    def test_restore_reports_all_failures(self):
+        corrupt = "2" * 40
+        corrupt_path = os.path.join(GymRepository.objects, corrupt[:2], corrupt[2:])
+        os.makedirs(os.path.dirname(corrupt_path), exist_ok=True)
+        with open(corrupt_path, 'wb') as f:
+            f.write(b"not an object")
+        self.addCleanup(os.remove, corrupt_path)
+
+        files = {os.path.join(self.directory, "a.txt"): "0" * 40,
+                 os.path.join(self.directory, "b.txt"): corrupt,
+                 os.path.join(self.directory, "c.txt"): blobify(b"c", GymRepository.objects)}
+        with self.assertRaises(GymException) as raised:
+            GymRepository._restore(files)
+        self.assertIn("a.txt", str(raised.exception))
+        self.assertIn("b.txt", str(raised.exception))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "c.txt")))
+
+
+class IndexStatTests(unittest.TestCase):
+    """Tests for the stat data kept in the index"""
+
+    def setUp(self):
+        self.file_path = "stat.txt"
+        with open(self.file_path, 'w') as file:
+            file.write("Stat file")
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        open(GymRepository.index, 'w').close()
+
+    def test_add_records_stat(self):
+        GymRepository.add([self.file_path])
+        filehash, signature = GymRepository._read_index()[self.file_path]
+        self.assertEqual(signature, stat_signature(self.file_path))
+
+    def test_add_detects_changes(self):
+        GymRepository.add([self.file_path])
+        old_hash = GymRepository._read_index()[self.file_path][0]
+
+        with open(self.file_path, 'w') as file:
+            file.write("Changed stat file")
+        GymRepository.add([self.file_path])
+
+        self.assertNotEqual(GymRepository._read_index()[self.file_path][0], old_hash)
+
+    def test_racy_entry_is_smudged(self):
+        future = time.time_ns() + 3600 * 10 ** 9
+        os.utime(self.file_path, ns=(future, future))
+        GymRepository.add([self.file_path])
+        self.assertIsNone(GymRepository._read_index()[self.file_path][1])
+
+
+class IndexFormatTests(unittest.TestCase):
+    """Tests for the binary index file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, "index")
+        self.entries = {f"dir{i % 7}/file{i}.txt": (f"{i:040x}", (i, i + 1, i + 2, i + 3) if i % 2 else None)
+                        for i in range(100)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_roundtrip(self):
+        write_index(self.index_path, self.entries)
+        with Index(self.index_path) as index:
+            self.assertEqual(len(index), len(self.entries))
+            self.assertEqual(dict(index.items()), self.entries)
+            self.assertEqual(list(index), sorted(self.entries))
+            self.assertEqual(index.get("dir3/file10.txt"), self.entries["dir3/file10.txt"])
+            self.assertIsNone(index.get("dir3/file11.txt"))
+            self.assertNotIn("missing.txt", index)
+
+    def test_update_index(self):
+        write_index(self.index_path, self.entries)
+        update_index(self.index_path, {"dir0/file0.txt": None, "dir0/file7.txt": ("f" * 40, None),
+                                       "a.txt": ("a" * 40, None), "z/z.txt": ("b" * 40, (1, 2, 3, 4))})
+
+        expected = dict(self.entries)
+        del expected["dir0/file0.txt"]
+        expected["dir0/file7.txt"] = ("f" * 40, None)
+        expected["a.txt"] = ("a" * 40, None)
+        expected["z/z.txt"] = ("b" * 40, (1, 2, 3, 4))
+        with Index(self.index_path) as index:
+            self.assertEqual(list(index.items()), sorted(expected.items()))
+
+    def test_text_index_is_read(self):
+        with open(self.index_path, 'w') as index_file:
+            index_file.write(f"b.txt {'b' * 40}\na.txt {'a' * 40} 1 2 3 4")
+        with Index(self.index_path) as index:
+            self.assertEqual(dict(index.items()), {"a.txt": ("a" * 40, (1, 2, 3, 4)), "b.txt": ("b" * 40, None)})
+
+        update_index(self.index_path, {"c.txt": ("c" * 40, None)})
+        with Index(self.index_path) as index:
+            self.assertEqual(list(index), ["a.txt", "b.txt", "c.txt"])
+
+    def test_empty_index(self):
+        open(self.index_path, 'w').close()
+        with Index(self.index_path) as index:
+            self.assertEqual(len(index), 0)
+            self.assertIsNone(index.get("a.txt"))
+
+    def test_corrupt_index(self):
+        write_index(self.index_path, self.entries)
+        with open(self.index_path, 'r+b') as index_file:
+            index_file.seek(100)
+            byte = index_file.read(1)
+            index_file.seek(100)
+            index_file.write(bytes([byte[0] ^ 1]))
+        with self.assertRaises(ValueError):
+            Index(self.index_path)
+
+
+class BlobTests(unittest.TestCase):
+    """Tests for the object storage"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blobify_roundtrip(self):
+        data = "Blob data".encode(encoding)
+        obj_hash = blobify(data, self.directory, fsync=True)
+        self.assertEqual(unblobify(obj_hash, self.directory), data)
+        self.assertEqual(os.listdir(os.path.join(self.directory, obj_hash[:2])), [obj_hash[2:]])
+
+    def test_blobify_existing_object_not_rewritten(self):
+        data = "Blob data".encode(encoding)
+        obj_hash = blobify(data, self.directory)
+        object_filename = os.path.join(self.directory, obj_hash[:2], obj_hash[2:])
+        os.utime(object_filename, ns=(0, 0))
+
+        blobify(data, self.directory)
+        self.assertEqual(os.stat(object_filename).st_mtime_ns, 0)
+
+    def test_streamed_blob_roundtrip(self):
+        data = os.urandom(1000) * 5
+        source = os.path.join(self.directory, "source")
+        destination = os.path.join(self.directory, "destination")
+        with open(source, 'wb') as f:
+            f.write(data)
+
+        chunk_size = Files.chunk_size
+        Files.chunk_size = 64
+        try:
+            obj_hash = blobify_file(source, self.directory)
+            unblobify_to_file(obj_hash, self.directory, destination)
+        finally:
+            Files.chunk_size = chunk_size
+
+        self.assertEqual(obj_hash, blobify(data, self.directory))
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+class ChunkTests(unittest.TestCase):
+    """Tests for storing large files as content-defined chunks"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "large.bin")
+        self.objects = os.path.join(self.directory, "objects")
+        self.sizes = (Chunker.min_chunk_size, Chunker.average_chunk_size, Chunker.max_chunk_size,
+                      Files.chunked_file_size)
+        Chunker.min_chunk_size, Chunker.average_chunk_size, Chunker.max_chunk_size = 256, 1024, 4096
+        Files.chunked_file_size = 1024
+        self.data = random.Random(0).randbytes(100000)
+
+    def tearDown(self):
+        Chunker.min_chunk_size, Chunker.average_chunk_size, Chunker.max_chunk_size, \
+            Files.chunked_file_size = self.sizes
+        shutil.rmtree(self.directory)
+
+    def _chunks(self, data):
+        return list(read_chunks(BytesIO(data)))
+
+    def test_chunks_are_content_defined(self):
+        chunks = self._chunks(self.data)
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertTrue(all(256 <= len(chunk) <= 4096 for chunk in chunks[:-1]))
+
+        # an insertion only changes the chunks around it
+        changed_chunks = self._chunks(self.data[:50000] + b"inserted" + self.data[50000:])
+        self.assertGreater(len(set(chunks) & set(changed_chunks)), len(chunks) - 4)
+
+    def test_chunked_file_roundtrip(self):
+        with open(self.file_path, 'wb') as f:
+            f.write(self.data)
+        obj_hash = blobify_file(self.file_path, self.objects)
+
+        self.assertEqual(obj_hash, sha1(self.data).hexdigest())
+        self.assertEqual(sum(size for _, size in chunk_list(obj_hash, self.objects)), len(self.data))
+        object_cache.clear()
+        self.assertEqual(unblobify(obj_hash, self.objects), self.data)
+        unblobify_to_file(obj_hash, self.objects, self.file_path + ".out")
+        with open(self.file_path + ".out", 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_chunking_is_asked_for(self):
+        with open(self.file_path, 'wb') as f:
+            f.write(self.data)
+        Files.chunked_file_size = None
+        self.assertIsNone(chunk_list(blobify_file(self.file_path, self.objects), self.objects))
+        obj_hash = blobify_file(self.file_path, os.path.join(self.directory, "chunked"), chunked_size=1024)
+        self.assertIsNotNone(chunk_list(obj_hash, os.path.join(self.directory, "chunked")))
+
+    def test_appended_file_reuses_chunks(self):
+        with open(self.file_path, 'wb') as f:
+            f.write(self.data)
+        first_hash = blobify_file(self.file_path, self.objects)
+        first_chunks = chunk_list(first_hash, self.objects)
+
+        with open(self.file_path, 'ab') as f:
+            f.write(b"appended" * 1000)
+        second_hash = blobify_file(self.file_path, self.objects, previous=first_hash)
+        second_chunks = chunk_list(second_hash, self.objects)
+
+        self.assertEqual(second_chunks[:len(first_chunks) - 1], first_chunks[:-1])
+        object_cache.clear()
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(unblobify(second_hash, self.objects), f.read())
+
+
+class PackTests(unittest.TestCase):
+    """Tests for the pack files"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = [f"Packed data {i}".encode(encoding) for i in range(50)]
+        self.hashes = [blobify(data, self.directory) for data in self.data]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_repack_moves_loose_objects(self):
+        pack_path, count = repack(self.directory)
+        self.assertEqual(count, len(self.data))
+        self.assertEqual(os.listdir(self.directory), ["pack"])
+
+        for obj_hash, data in zip(self.hashes, self.data):
+            self.assertTrue(object_exists(obj_hash, self.directory))
+            self.assertEqual(unblobify(obj_hash, self.directory), data)
+        self.assertFalse(object_exists("0" * 40, self.directory))
+        for name in ("typo", "abc", "0" * 41):
+            self.assertFalse(object_exists(name, self.directory))
+            with self.assertRaises(FileNotFoundError):
+                unblobify(name, self.directory)
+
+    def test_repack_merges_packs(self):
+        repack(self.directory)
+        new_hash = blobify("Loose data".encode(encoding), self.directory)
+        pack_path, count = repack(self.directory)
+
+        self.assertEqual(count, len(self.data) + 1)
+        self.assertEqual(len(os.listdir(os.path.dirname(pack_path))), 2)
+
+        destination = os.path.join(self.directory, "destination")
+        unblobify_to_file(new_hash, self.directory, destination)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), "Loose data".encode(encoding))
+
+
+class DeltaTests(unittest.TestCase):
+    """Tests for the deltas stored in packs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_delta_roundtrip(self):
+        base = os.urandom(10000)
+        target = base[:3000] + b"inserted" + base[3001:9000] + base[:100]
+        delta = make_delta(base, target)
+        self.assertLess(len(delta), 200)
+        self.assertEqual(apply_delta(base, delta), target)
+
+    def test_repack_with_deltas(self):
+        versions = [os.urandom(50000)]
+        for i in range(5):
+            versions.append(versions[-1][:i * 1000] + b"edit" + versions[-1][i * 1000 + 4:])
+        hashes = [blobify(version, self.directory) for version in versions]
+
+        # newer versions are the bases of older ones
+        delta_bases = {hashes[i]: hashes[i + 1] for i in reversed(range(len(hashes) - 1))}
+        pack_path, _ = repack(self.directory, delta_bases, max_depth=3)
+
+        self.assertLess(os.path.getsize(pack_path), 3 * 50000)
+        for obj_hash, version in zip(hashes, versions):
+            self.assertEqual(unblobify(obj_hash, self.directory), version)
+
+        # repacking again rebuilds the chains from the objects in the old pack
+        repack(self.directory)
+        for obj_hash, version in zip(hashes, versions):
+            self.assertEqual(unblobify(obj_hash, self.directory), version)
+
+
+class ObjectCacheTests(unittest.TestCase):
+    """Tests for the cache of decoded objects"""
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = ObjectCache(10)
+        cache.put("a", b"aaaa", 4)
+        cache.put("b", b"bbbb", 4)
+        cache.get("a")
+        cache.put("c", b"cccc", 4)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"aaaa")
+        self.assertEqual(cache.get("c"), b"cccc")
+        self.assertEqual(cache.stats()["hits"], 3)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.size, 8)
+
+    def test_unblobify_hits_cache(self):
+        directory = tempfile.mkdtemp()
+        obj_hash = blobify("Cached data".encode(encoding), directory)
+        unblobify(obj_hash, directory)
+        hits = Files.object_cache.hits
+        self.assertEqual(unblobify(obj_hash, directory), "Cached data".encode(encoding))
+        self.assertEqual(Files.object_cache.hits, hits + 1)
+        shutil.rmtree(directory)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
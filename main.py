@@ -1,22 +1,28 @@
-from GymRepository import *
 import sys
-from datetime import datetime
+import Server
+
+# a running server answers the command without gym being imported here
+if __name__ == "__main__":
+    forwarded_status = Server.forward(sys.argv)
+    if forwarded_status is not None:
+        sys.exit(forwarded_status)
+
+from GymRepository import *
 from traceback import print_exception
 from ArgumentParsers import *
+from ErrorLog import log_error
 
 
 def log_exception(exc_type, exc_value, exc_traceback):
-    with open(GymRepository.log_file, 'r') as f:
-        logs = f.read()
-    with open(GymRepository.log_file, 'w') as f:
-        time = datetime.now().strftime("%Y-%m-%D %H:%M:%S")
-        f.write(f"[{time}]\n\n")
-        print_exception(exc_type, exc_value, exc_traceback, file=f)
-        f.write('-' * 30 + '\n')
-        f.write(logs)
-        print("\nAn error has occurred! "
-              "\nWe as the developer team have already "
-              "\nbeen notified and work on fixing it.")
+    try:
+        log_error(GymRepository.log_file, exc_type, exc_value, exc_traceback)
+    except OSError:
+        # outside of a repository there is nowhere to log the error to
+        print_exception(exc_type, exc_value, exc_traceback)
+        return
+    print("\nAn error has occurred! "
+          "\nWe as the developer team have already "
+          "\nbeen notified and work on fixing it.")
 
 
 sys.excepthook = log_exception
@@ -33,29 +39,56 @@ def main(args):
     flags = args[2:]
     match command:
         case "add":
-            GymRepository.add(flags)
+            add_args = add_parser.parse_args(args[1:])
+            GymRepository.add(add_args.paths, jobs=add_args.jobs, chunked_size=add_args.chunked_size)
 
         case "branch":
-            branch_args = branch_parser.parse_args()
+            branch_args = branch_parser.parse_args(args[1:])
             GymRepository.branch(branch_args)
 
         case "checkout":
-            checkout_args = checkout_parser.parse_args()
+            checkout_args = checkout_parser.parse_args(args[1:])
             GymRepository.checkout(checkout_args)
 
         case "commit":
-            commit_args = commit_parser.parse_args()
+            commit_args = commit_parser.parse_args(args[1:])
             GymRepository.commit(commit_args)
 
+        case "diff":
+            diff_args = diff_parser.parse_args(args[1:])
+            GymRepository.diff(diff_args)
+
         case "init":
             GymRepository.init(flags)
 
+        case "log":
+            log_args = log_parser.parse_args(args[1:])
+            GymRepository.log(log_args)
+
+        case "log-errors":
+            log_errors_args = log_errors_parser.parse_args(args[1:])
+            GymRepository.log_errors(log_errors_args)
+
         case "merge":
-            merge_args = merge_parser.parse_args()
+            merge_args = merge_parser.parse_args(args[1:])
             GymRepository.merge(merge_args)
 
+        case "repack":
+            GymRepository.repack(flags)
+
+        case "server":
+            server_args = server_parser.parse_args(args[1:])
+            if server_args.stop:
+                Server.stop()
+            else:
+                GymRepository.assert_repo()
+                Server.serve(main, detach=server_args.detach)
+
+        case "status":
+            GymRepository.status(flags)
+
         case "tag":
-            tag_args = tag_parser.parse_args()
+            tag_args = tag_parser.parse_args(args[1:])
             GymRepository.tag(tag_args)
 
 